@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import getopt
+import tempfile
+from statistics import median
+
+from knowledge_base.contextAware_KB import ContextAwareKnowledgeBase, SNAPSHOT_SUFFIX
+from generation_pipeline import file_fingerprint
+
+
+# =========================================================
+# Convert a JSON knowledge base to the binary format, and benchmark both
+# =========================================================
+
+def convert(input_path: str, output_path: str):
+    kb = ContextAwareKnowledgeBase(input_path)
+    if output_path.endswith(".npz"):
+        # Tagged with its source, so the pipeline uses it as the snapshot of `input_path`.
+        kb.save_snapshot(output_path, file_fingerprint(input_path))
+    else:
+        kb.save(output_path)
+    return kb
+
+
+def timed(fn, repeat: int) -> float:
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return median(runs) * 1000
+
+
+def load_ready(path: str):
+    # Loaded and searchable: the JSON format still has to refit and rebuild the index.
+    kb = ContextAwareKnowledgeBase(path)
+    kb.search("")
+    return kb
+
+
+def benchmark(kb: ContextAwareKnowledgeBase, input_path: str, repeat: int):
+    with tempfile.TemporaryDirectory() as workdir:
+        json_path = os.path.join(workdir, "kb.json")
+        binary_path = os.path.join(workdir, "kb.npz")
+        rows = [
+            ("json", timed(lambda: kb.save(json_path), repeat), timed(lambda: load_ready(json_path), repeat),
+             os.path.getsize(json_path)),
+            ("binary", timed(lambda: kb.save(binary_path), repeat), timed(lambda: load_ready(binary_path), repeat),
+             os.path.getsize(binary_path)),
+        ]
+
+    print(f"{len(kb.knowledge)} entries, {len(kb.term_index)} terms (from {input_path})")
+    print(f"{'format':<10}{'save ms':>12}{'load ms':>12}{'size KB':>12}")
+    for name, save_ms, load_ms, size in rows:
+        print(f"{name:<10}{save_ms:>12.1f}{load_ms:>12.1f}{size / 1024:>12.1f}")
+
+
+def main(options: dict):
+    input_path = options["--input"]
+    output_path = options.get("--output", input_path + SNAPSHOT_SUFFIX)
+
+    kb = convert(input_path, output_path)
+    print(f"Wrote {output_path}")
+    if "--benchmark" in options:
+        benchmark(kb, input_path, int(options.get("--repeat", 5)))
+
+
+if __name__ == "__main__":
+    opts, _ = getopt.getopt(sys.argv[1:], "", ["input=", "output=", "benchmark", "repeat="])
+    main(dict(opts))
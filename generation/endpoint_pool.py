@@ -0,0 +1,125 @@
+import threading
+
+from rate_limiter import EndpointLimiter, is_retryable
+
+
+class Endpoint:
+    def __init__(self, name: str, client, max_concurrency: int, limiter: EndpointLimiter):
+        self.name = name
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.limiter = limiter
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.completed = 0
+
+
+class EndpointPool:
+    """
+    Several replicas of the same model behind one client-like object.
+
+    Each call goes to the healthy endpoint with the fewest outstanding
+    requests that is below its concurrency cap, through that endpoint's own
+    EndpointLimiter. An endpoint that keeps failing is taken out of rotation
+    and a background thread probes it with `models.list()` until it answers
+    again; a failed call is retried on another endpoint.
+    """
+
+    def __init__(self, endpoints: list, unhealthy_after: int = 3, health_interval: float = 15.0):
+        if not endpoints:
+            raise ValueError("An endpoint pool needs at least one endpoint")
+        self.endpoints = endpoints
+        self.unhealthy_after = unhealthy_after
+        self.health_interval = health_interval
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._checker = None
+
+    @classmethod
+    def from_urls(cls, urls: list, api_key: str, max_concurrency: int,
+                  requests_per_minute: float = None, tokens_per_minute: float = None, **options):
+        from openai import OpenAI
+
+        endpoints = [
+            Endpoint(url, OpenAI(api_key=api_key, base_url=url, max_retries=0), max_concurrency,
+                     EndpointLimiter(requests_per_minute, tokens_per_minute,
+                                     max_concurrency=max_concurrency, max_retries=2))
+            for url in urls
+        ]
+        return cls(endpoints, **options)
+
+    def start(self):
+        self._checker = threading.Thread(target=self._health_loop, daemon=True)
+        self._checker.start()
+        return self
+
+    def close(self):
+        self._stopped.set()
+
+    def call(self, fn, tokens: float = 0):
+        """
+        Run `fn(client)` on the least loaded healthy endpoint and return
+        (result, retries), failing over to other endpoints on retryable errors.
+        """
+        retries = 0
+        for attempt in range(len(self.endpoints)):
+            endpoint = self._acquire()
+            try:
+                result, endpoint_retries = endpoint.limiter.call(lambda: fn(endpoint.client), tokens)
+            except Exception as exc:
+                self._release(endpoint, success=False)
+                if not is_retryable(exc) or attempt == len(self.endpoints) - 1:
+                    raise
+                retries += endpoint.limiter.max_retries + 1
+                continue
+
+            self._release(endpoint, success=True)
+            return result, retries + endpoint_retries
+
+    def _acquire(self) -> Endpoint:
+        with self._cond:
+            while True:
+                candidates = [e for e in self.endpoints if e.healthy and e.outstanding < e.max_concurrency]
+                if candidates:
+                    endpoint = min(candidates, key=lambda e: e.outstanding)
+                    endpoint.outstanding += 1
+                    return endpoint
+                # Nothing healthy: wait for capacity or for the health check to revive one.
+                self._cond.wait(self.health_interval)
+
+    def _release(self, endpoint: Endpoint, success: bool):
+        with self._cond:
+            endpoint.outstanding -= 1
+            if success:
+                endpoint.failures = 0
+                endpoint.completed += 1
+            else:
+                endpoint.failures += 1
+                healthy_left = sum(e.healthy for e in self.endpoints)
+                if endpoint.failures >= self.unhealthy_after and healthy_left > 1:
+                    endpoint.healthy = False
+            self._cond.notify_all()
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_interval):
+            for endpoint in self.endpoints:
+                if endpoint.healthy:
+                    continue
+                try:
+                    endpoint.client.models.list()
+                except Exception:
+                    continue
+                with self._cond:
+                    # Back on probation: a single further failure takes it out again.
+                    endpoint.healthy = True
+                    endpoint.failures = self.unhealthy_after - 1
+                    self._cond.notify_all()
+
+    def summary(self) -> dict:
+        with self._cond:
+            return {
+                endpoint.name: {"completed": endpoint.completed, "healthy": endpoint.healthy,
+                                **endpoint.limiter.summary()}
+                for endpoint in self.endpoints
+            }
@@ -2,11 +2,27 @@ import os
 import json
 import sys
 import getopt
-from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor
+import time
+import hashlib
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-from openai import OpenAI
-from HarmonyAPI.KnowledgeBase.Knowledge_init import ContextAwareKnowledgeBase
+# openai, tqdm and the knowledge base (scikit-learn/scipy) are imported where
+# they are first needed, so short jobs do not pay for them at startup.
+from run_journal import RunJournal
+from response_cache import ResponseCache
+from run_metrics import MetricsLog
+from input_reader import iter_json_items
+from rate_limiter import EndpointLimiter
+from endpoint_pool import EndpointPool
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent workers may each build the shared index
+    fcntl = None
+
+if TYPE_CHECKING:
+    from knowledge_base.contextAware_KB import ContextAwareKnowledgeBase
 
 
 # =========================================================
@@ -23,13 +39,18 @@ def init_clients():
     Initialize LLM clients.
     NOTE: API keys and model identifiers are intentionally removed.
     """
+    from openai import OpenAI
+
+    # Retries are left to EndpointLimiter, so it sees every throttle and failure.
     generic_client = OpenAI(
         api_key=os.getenv("LLM_API_KEY"),
-        base_url="https://your-llm-endpoint.example.com"
+        base_url="https://your-llm-endpoint.example.com",
+        max_retries=0
     )
     auxiliary_client = OpenAI(
         api_key=os.getenv("AUX_LLM_API_KEY"),
-        base_url="https://your-aux-endpoint.example.com"
+        base_url="https://your-aux-endpoint.example.com",
+        max_retries=0
     )
     return generic_client, auxiliary_client
 
@@ -64,8 +85,11 @@ JSON input:
     return instruct
 
 
-def gen_instruct3(tag_list: str, official: str, knowledge: str, name: str):
-    instruct3 = '''
+# gen_instruct3 is assembled from a static header and constraints block
+# around the per-item JSON input. The "prefix" layout sends the static parts
+# first as one system message that is identical across requests, so servers
+# with prefix (KV) caching only prefill the short per-item suffix.
+INSTRUCT3_HEADER = '''
 You are a HarmonyOS API Comment Translator. 
 You will receive one JSON input and must generate exactly one English API comment in a single line.
 
@@ -77,17 +101,9 @@ Instructions:
 5. Always use terms from "Translation_Dictionary" exactly as they appear.
 6. Output format: One single-line English sentence. No other text.
 
-JSON input:
-{
-  "API_Metadata": {
-    "API_Tags": ''' + tag_list + ''',
-    "Chinese_Comment": ''' + official + '''
-  },
-  "Translation_Dictionary": ''' + knowledge + ''',
-  "API_Name": ''' + name + ''',
-}
+'''
 
-Comment Constraints: {
+INSTRUCT3_CONSTRAINTS = '''Comment Constraints: {
 
   "@function_category": {
 
@@ -134,20 +150,239 @@ Comment Constraints: {
 }
 
 '''
-    return instruct3
+
+INSTRUCT3_SYSTEM = INSTRUCT3_HEADER + INSTRUCT3_CONSTRAINTS + "The JSON input is given in the user message.\n"
+
+PROMPT_LAYOUTS = ("legacy", "prefix")
+
+
+def gen_instruct3_input(tag_list: str, official: str, knowledge: str, name: str):
+    return '''JSON input:
+{
+  "API_Metadata": {
+    "API_Tags": ''' + tag_list + ''',
+    "Chinese_Comment": ''' + official + '''
+  },
+  "Translation_Dictionary": ''' + knowledge + ''',
+  "API_Name": ''' + name + ''',
+}
+
+'''
+
+
+def gen_instruct3(tag_list: str, official: str, knowledge: str, name: str):
+    return INSTRUCT3_HEADER + gen_instruct3_input(tag_list, official, knowledge, name) + INSTRUCT3_CONSTRAINTS
+
+
+def build_messages(layout: str, tag_list: str, official: str, knowledge: str, name: str) -> list:
+    if layout == "prefix":
+        return [{"role": "system", "content": INSTRUCT3_SYSTEM},
+                {"role": "user", "content": gen_instruct3_input(tag_list, official, knowledge, name)}]
+    return [{"role": "user", "content": gen_instruct3(tag_list, official, knowledge, name)}]
 
 
 # =========================================================
 # Knowledge Retrieval
 # =========================================================
 
-def retrieve_knowledge(kb: ContextAwareKnowledgeBase, official_doc: str) -> str:
+def format_knowledge(matches: list) -> str:
     entries = []
-    for match in kb.search(official_doc):
-        entries.append(f'''"{match['Chine Term']}" : "{match['English Term']}".\n''')
+    for match in matches:
+        entries.append(f'''"{match['source_term']}" : "{match['target_term']}".\n''')
     return ";".join(entries)
 
 
+def retrieve_knowledge(kb: "ContextAwareKnowledgeBase", official_doc: str) -> str:
+    return format_knowledge(kb.search(official_doc))
+
+
+def file_fingerprint(path: str) -> str:
+    if not os.path.exists(path):
+        return ""
+    stat = os.stat(path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def iter_prepared_knowledge(knowledge_file: str, header: dict):
+    """
+    Stream the persisted Translation_Dictionary strings, or return None if the
+    file is missing or was built from a different KB or input.
+    """
+    if not os.path.exists(knowledge_file):
+        return None
+
+    f = open(knowledge_file, "r", encoding="utf-8")
+    if json.loads(f.readline() or "{}") != header:
+        f.close()
+        return None
+
+    def entries():
+        with f:
+            for line in f:
+                yield json.loads(line)
+    return entries()
+
+
+def parse_shard(spec: str) -> tuple:
+    shard, count = (int(part) for part in spec.split("/"))
+    if not 0 <= shard < count:
+        raise ValueError(f"Invalid shard {spec!r}: expected i/N with 0 <= i < N")
+    return shard, count
+
+
+def iter_shard(items, shard: tuple = None):
+    """
+    Yield (index, item) pairs, keeping only the items of `shard` = (i, N),
+    i.e. every N-th item starting at i, indexed by position in the full input.
+    """
+    for index, item in enumerate(items):
+        if shard is None or index % shard[1] == shard[0]:
+            yield index, item
+
+
+def load_knowledge_base(knowledge_path: str) -> "ContextAwareKnowledgeBase":
+    """
+    Load the KB from its binary snapshot (`knowledge_path` + SNAPSHOT_SUFFIX)
+    when that was built from the current JSON file; otherwise load the JSON
+    file and (re)write the snapshot for the next run.
+    """
+    from knowledge_base.contextAware_KB import ContextAwareKnowledgeBase, SNAPSHOT_SUFFIX
+
+    snapshot = knowledge_path + SNAPSHOT_SUFFIX
+    source = file_fingerprint(knowledge_path)
+    kb = ContextAwareKnowledgeBase()
+    try:
+        if os.path.exists(snapshot) and kb.load_snapshot(snapshot) == source:
+            return kb
+    except ValueError:
+        pass  # written by another format version; rebuilt below
+
+    kb = ContextAwareKnowledgeBase(knowledge_path)
+    if source and kb.knowledge:
+        try:
+            kb.save_snapshot(snapshot, source)
+        except (OSError, ValueError):
+            pass  # unwritable, or a vectorizer the snapshot cannot represent
+    return kb
+
+
+def attach_knowledge_index(knowledge_path: str, index_path: str) -> "ContextAwareKnowledgeBase":
+    """
+    Attach read-only to the shared KB index at `index_path`, so that every
+    worker process maps the same pages instead of loading its own KB. The
+    index is (re)built first when missing or built from another version of
+    the JSON file; a lock file makes concurrent workers wait for the one
+    process that builds it.
+    """
+    from knowledge_base.contextAware_KB import ContextAwareKnowledgeBase
+
+    source = file_fingerprint(knowledge_path)
+    with open(index_path + ".lock", "a") as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        kb = ContextAwareKnowledgeBase()
+        try:
+            if os.path.exists(index_path) and kb.attach_index(index_path) == source:
+                return kb
+        except ValueError:
+            pass  # written by another format version; rebuilt below
+
+        kb = load_knowledge_base(knowledge_path)
+        try:
+            kb.save_index(index_path, source)
+        except ValueError:
+            return kb  # a vectorizer the index cannot represent: use this process's own KB
+    kb = ContextAwareKnowledgeBase()
+    kb.attach_index(index_path)
+    return kb
+
+
+def iter_with_knowledge(indexed_items, knowledge_path: str, knowledge_file: str, header: dict,
+                        max_batch: int = 1024, kb_index: str = None):
+    """
+    Yield (index, item, Translation_Dictionary, retrieval seconds) as
+    (index, item) pairs stream in; batched retrieval time is amortized over
+    the batch.
+
+    Prepared knowledge is reused when it matches `header`. Otherwise items are
+    retrieved with batched KB searches whose size doubles from 1 up to
+    `max_batch`, so the first item is available right away while later ones
+    are amortized, and the results are persisted for the next run. The file
+    only replaces `knowledge_file` once every item has been retrieved.
+
+    With `kb_index`, searches run on the shared index at that path (see
+    attach_knowledge_index) instead of a KB loaded by this process.
+    """
+    prepared = iter_prepared_knowledge(knowledge_file, header)
+    if prepared is not None:
+        for (index, item), knowledge in zip(indexed_items, prepared):
+            yield index, item, knowledge, 0.0
+        return
+
+    if kb_index:
+        kb = attach_knowledge_index(knowledge_path, kb_index)
+    else:
+        kb = load_knowledge_base(knowledge_path)
+    partial_file = f"{knowledge_file}.partial.{os.getpid()}"
+    try:
+        with open(partial_file, "w", encoding="utf-8") as sidecar:
+            sidecar.write(json.dumps(header) + "\n")
+
+            batch_size, batch = 1, []
+            for index, item in indexed_items:
+                batch.append((index, item))
+                if len(batch) < batch_size:
+                    continue
+                yield from _retrieve_batch(kb, batch, sidecar)
+                batch_size, batch = min(batch_size * 2, max_batch), []
+            yield from _retrieve_batch(kb, batch, sidecar)
+
+        os.replace(partial_file, knowledge_file)
+    finally:
+        # An aborted run (exception, Ctrl-C, generator closed) leaves nothing behind.
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+
+
+def _retrieve_batch(kb: "ContextAwareKnowledgeBase", batch: list, sidecar):
+    if not batch:
+        return
+    start = time.monotonic()
+    officials = [item['apiIntro']['official_doc'] for _, item in batch]
+    results = [format_knowledge(matches) for matches in kb.search_many(officials)]
+    elapsed = (time.monotonic() - start) / len(batch)
+
+    for (index, item), knowledge in zip(batch, results):
+        sidecar.write(json.dumps(knowledge, ensure_ascii=False) + "\n")
+        yield index, item, knowledge, elapsed
+
+
+def knowledge_header(input_file: str, knowledge_path: str, shard: tuple = None) -> dict:
+    header = {"input": file_fingerprint(input_file), "knowledge_base": file_fingerprint(knowledge_path)}
+    if shard:
+        header["shard"] = list(shard)
+    return header
+
+
+def default_knowledge_file(input_file: str, shard: tuple = None) -> str:
+    if shard:
+        return f"{input_file}.knowledge.shard{shard[0]}of{shard[1]}.jsonl"
+    return input_file + ".knowledge.jsonl"
+
+
+def prepare_knowledge(input_file: str, knowledge_path: str, knowledge_file: str = None,
+                      shard: tuple = None, kb_index: str = None):
+    """
+    Bulk retrieval pre-pass: persist the Translation_Dictionary string of every
+    item (of the shard) as JSONL (a header line identifying the input, KB and
+    shard, then one string per item) so that generation never waits on retrieval.
+    """
+    header = knowledge_header(input_file, knowledge_path, shard)
+    for _ in iter_with_knowledge(iter_shard(iter_json_items(input_file), shard), knowledge_path,
+                                 knowledge_file or default_knowledge_file(input_file, shard), header,
+                                 kb_index=kb_index):
+        pass
+
 
 def strip_official_comment(api_intro: dict):
     official = api_intro['apiIntro']['official_doc']
@@ -160,49 +395,413 @@ def strip_official_comment(api_intro: dict):
 # Comment Generation Pipeline
 # =========================================================
 
-def generate_comments(input_file: str, output_file: str, knowledge_path: str, llm_client):
-    with open(input_file, "r") as f:
-        dataset = json.load(f)
+MODEL_NAME = "GENERIC_LLM_MODEL"
+AUX_MODEL_NAME = "AUXILIARY_LLM_MODEL"
+TEMPERATURE = 0.01
 
-    kb = ContextAwareKnowledgeBase(knowledge_path)
 
-    with open(output_file, "w") as writer:
-        for item in tqdm(dataset, desc="Generating comments"):
-            official, intro, name = strip_official_comment(item)
-            knowledge = retrieve_knowledge(kb, official)
+def estimate_tokens(text: str) -> int:
+    # Roughly one token per CJK character and per four other characters.
+    cjk = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+    return cjk + (len(text) - cjk + 3) // 4
+
 
-            prompt = gen_instruct3(str(intro), official, knowledge, name)
+def stream_completion(llm_client, model: str, messages: list, params: dict, first_line_only: bool):
+    stats = {"output_tokens": 0, "stopped_early": False, "started_at": time.monotonic(),
+             "first_token_at": None, "last_token_at": None}
+    response = llm_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=TEMPERATURE,
+        **params
+    )
 
-            response = llm_client.chat.completions.create(
-                model="GENERIC_LLM_MODEL",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.01,
-                stream=True
+    completion = ""
+    for chunk in response:
+        if chunk.choices and hasattr(chunk.choices[0].delta, "content"):
+            text = chunk.choices[0].delta.content or ""
+            completion += text
+            if text:
+                stats["output_tokens"] += 1
+                stats["last_token_at"] = time.monotonic()
+                stats["first_token_at"] = stats["first_token_at"] or stats["last_token_at"]
+            # A chunk contains a line break iff splitting it changes it.
+            if first_line_only and text and text.splitlines() != [text]:
+                stats["stopped_early"] = True
+                break
+
+    if stats["stopped_early"] and hasattr(response, "close"):
+        response.close()
+    return completion, stats
+
+
+def request_completion(llm_client, messages: list, cache: ResponseCache = None,
+                       first_line_only: bool = False, max_tokens: int = None,
+                       model: str = MODEL_NAME, limiter: EndpointLimiter = None):
+    """
+    Stream one completion and return (text, stats).
+
+    With `first_line_only`, the stream is closed as soon as the first line
+    break arrives, so the discarded tail is never generated or waited on.
+    Savings are estimated against `max_tokens` at the observed decode rate,
+    since the length of a tail that was never produced is unknown otherwise.
+    Network calls (not cache hits) go through `limiter`, which retries
+    transient failures and paces requests and tokens per minute.
+    """
+    params = {"stream": True}
+    if max_tokens:
+        params["max_tokens"] = max_tokens
+    stats = {"cache_hit": False, "output_tokens": 0, "ttft_s": None, "latency_s": 0.0,
+             "stopped_early": False, "tokens_saved": None, "seconds_saved": None, "retries": 0}
+
+    key = None
+    if cache:
+        key = ResponseCache.make_key(model, messages, TEMPERATURE,
+                                     first_line_only=first_line_only, **params)
+        cached = cache.get(key)
+        if cached is not None:
+            stats["cache_hit"] = True
+            return cached, stats
+
+    def call(client=llm_client):
+        # An EndpointPool limiter passes the client of the endpoint it picked.
+        return stream_completion(client, model, messages, params, first_line_only)
+
+    start = time.monotonic()
+    if limiter:
+        budget = sum(estimate_tokens(message["content"]) for message in messages) + (max_tokens or 0)
+        (completion, streamed), stats["retries"] = limiter.call(call, tokens=budget)
+    else:
+        completion, streamed = call()
+    stats["latency_s"] = time.monotonic() - start
+    stats["output_tokens"] = streamed["output_tokens"]
+    stats["stopped_early"] = streamed["stopped_early"]
+    if streamed["first_token_at"]:
+        # Measured from the start of the successful attempt, excluding retries.
+        stats["ttft_s"] = streamed["first_token_at"] - streamed["started_at"]
+
+    if stats["stopped_early"] and max_tokens:
+        stats["tokens_saved"] = max(max_tokens - stats["output_tokens"], 0)
+        first_token_at, last_token_at = streamed["first_token_at"], streamed["last_token_at"]
+        if stats["output_tokens"] > 1 and last_token_at > first_token_at:
+            rate = (stats["output_tokens"] - 1) / (last_token_at - first_token_at)
+            stats["seconds_saved"] = stats["tokens_saved"] / rate
+
+    if cache:
+        cache.put(key, completion)
+    return completion, stats
+
+
+def request_comment(llm_client, prompt, cache: ResponseCache = None, **options):
+    """`prompt` is either a single user message or a list of chat messages."""
+    messages = prompt if isinstance(prompt, list) else [{"role": "user", "content": prompt}]
+    comment, stats = request_completion(llm_client, messages, cache, **options)
+    lines = comment.splitlines()
+    return (lines[0] if lines else ""), stats
+
+
+class OrderedWriter:
+    """
+    Reorder buffer: accepts lines completed in any order and writes them
+    to the output in the original dataset order. With `step` > 1 it expects
+    the strided indices of one shard (start_index, start_index + step, ...).
+    """
+
+    def __init__(self, writer, start_index: int = 0, step: int = 1):
+        self.writer = writer
+        self.next_index = start_index
+        self.step = step
+        self.pending = {}
+
+    def put(self, index: int, line: str):
+        # Duplicate completions (e.g. replayed from the journal) are ignored.
+        if index < self.next_index or index in self.pending:
+            return
+        self.pending[index] = line
+        while self.next_index in self.pending:
+            self.writer.write(self.pending.pop(self.next_index) + "\n")
+            self.next_index += self.step
+        self.writer.flush()
+
+
+def generate_comments(input_file: str, output_file: str, knowledge_path: str, llm_client,
+                      workers: int = 1, journal_path: str = None, resume: bool = False,
+                      cache: ResponseCache = None, first_line_only: bool = False,
+                      max_tokens: int = None, metrics_path: str = None, knowledge_file: str = None,
+                      refine_client=None, refine_workers: int = 1,
+                      limiter: EndpointLimiter = None, refine_limiter: EndpointLimiter = None,
+                      dedup: bool = True, shard: tuple = None, prompt_layout: str = "legacy",
+                      kb_index: str = None):
+    """
+    Generate one comment per input item with up to `workers` requests in
+    flight, writing the comments in input order. The options mirror the
+    command-line flags described in the README.
+    """
+    if prompt_layout not in PROMPT_LAYOUTS:
+        raise ValueError(f"Unknown prompt layout {prompt_layout!r}, expected one of {PROMPT_LAYOUTS}")
+
+    def pick_limiter(client, given, pool_size):
+        # An EndpointPool limits each of its endpoints itself.
+        if isinstance(client, EndpointPool):
+            return client
+        return given or EndpointLimiter(max_concurrency=pool_size)
+
+    from tqdm import tqdm
+
+    limiter = pick_limiter(llm_client, limiter, workers)
+    refine_limiter = pick_limiter(refine_client, refine_limiter, refine_workers)
+
+    # Items are parsed and retrieved lazily, so the first request goes out
+    # before the rest of the input has been read.
+    items = iter_with_knowledge(
+        iter_shard(iter_json_items(input_file), shard), knowledge_path,
+        knowledge_file or default_knowledge_file(input_file, shard),
+        knowledge_header(input_file, knowledge_path, shard), kb_index=kb_index
+    )
+
+    journal = RunJournal(journal_path or output_file + ".journal.jsonl")
+    finished = journal.load() if resume else {}
+
+    metrics = MetricsLog(metrics_path or os.devnull)
+    saved = {"items": 0, "tokens": 0, "seconds": 0.0}
+    max_refine_queue = 0
+    # Rendered-prompt digest -> duplicates waiting on it / final comment once known.
+    waiting = {}
+    resolved = {}
+    duplicates = 0
+    previous_prompt = ""
+    shared_chars = 0
+    prompt_chars = 0
+    request_options = {"first_line_only": first_line_only, "max_tokens": max_tokens}
+
+    def generate(index: int, key: str, prompt: list):
+        comment, stats = request_comment(llm_client, prompt, cache, limiter=limiter, **request_options)
+        if not refine_client:
+            # Journal from the worker so requests that finish during shutdown are kept.
+            journal.record(index, key, comment)
+        return comment, stats
+
+    def refine(index: int, key: str, draft: str, queued_at: float):
+        stats = {"queue_s": time.monotonic() - queued_at}
+        comment, request_stats = request_comment(refine_client, gen_instruct1(draft), cache,
+                                                 model=AUX_MODEL_NAME, limiter=refine_limiter,
+                                                 **request_options)
+        journal.record(index, key, comment)
+        return comment, {**stats, **request_stats}
+
+    with open(output_file, "w") as writer, \
+            journal.open(resume=resume), \
+            metrics, \
+            ThreadPoolExecutor(max_workers=workers) as executor, \
+            ThreadPoolExecutor(max_workers=refine_workers) as refine_executor, \
+            tqdm(desc="Generating comments") as progress:
+        ordered = OrderedWriter(writer, *shard) if shard else OrderedWriter(writer)
+        inflight = {}
+        refining = {}
+        start = time.monotonic()
+
+        def account(stats: dict):
+            if stats["stopped_early"]:
+                saved["items"] += 1
+                saved["tokens"] += stats["tokens_saved"] or 0
+                saved["seconds"] += stats["seconds_saved"] or 0.0
+
+        def finish(index: int, comment: str, record: dict, digest: str):
+            ordered.put(index, comment)
+            metrics.write(record)
+            progress.update(1)
+
+            if dedup:
+                resolved[digest] = (comment, index)
+                for duplicate, key in waiting.pop(digest, []):
+                    share(duplicate, key, comment, index)
+
+        def share(index: int, key: str, comment: str, source: int):
+            journal.record(index, key, comment)
+            ordered.put(index, comment)
+            metrics.write({"index": index, "duplicate_of": source})
+            progress.update(1)
+
+        def collect(timeout=None):
+            nonlocal max_refine_queue
+            done, _ = wait(list(inflight) + list(refining), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                comment, stats = future.result()
+                if future in inflight:
+                    index, key, item_stats, digest = inflight.pop(future)
+                    account(stats)
+                    record = {"index": index, **item_stats, **stats}
+                    if refine_client:
+                        queued = refine_executor.submit(refine, index, key, comment, time.monotonic())
+                        refining[queued] = (index, record, digest)
+                        max_refine_queue = max(max_refine_queue, len(refining) - refine_workers)
+                    else:
+                        finish(index, comment, record, digest)
+                else:
+                    index, record, digest = refining.pop(future)
+                    account(stats)
+                    finish(index, comment, {**record, "refine": stats}, digest)
+
+            progress.set_postfix(
+                inflight=len(inflight),
+                refining=len(refining),
+                buffered=len(ordered.pending),
+                rate=f"{progress.n / max(time.monotonic() - start, 1e-6):.2f}/s",
+                refresh=False
             )
 
-            comment = ""
-            for chunk in response:
-                if chunk.choices and hasattr(chunk.choices[0].delta, "content"):
-                    comment += chunk.choices[0].delta.content or ""
+        def window_full() -> bool:
+            # Stage one also waits while the refinement backlog exceeds twice its pool size.
+            return len(inflight) >= workers or len(refining) >= 2 * refine_workers
 
-            writer.write(comment.splitlines()[0] + "\n")
+        for index, item, knowledge, retrieval_s in items:
+            # Prompt building stays on this thread; workers only talk to the LLM.
+            prompt_start = time.monotonic()
+            official, intro, name = strip_official_comment(item)
+            inputs = (str(intro), official, knowledge, name)
+            variant = (["refined"] if refine_client else []) + ([prompt_layout] if prompt_layout != "legacy" else [])
+            key = RunJournal.item_key(*inputs, *variant)
+
+            messages = build_messages(prompt_layout, str(intro), official, knowledge, name)
+            prompt = "".join(message["content"] for message in messages)
+            digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+            record = finished.get(index)
+            if record and record["key"] == key:
+                ordered.put(index, record["comment"])
+                progress.update(1)
+                if dedup:
+                    # Later duplicates of a journaled item reuse its comment too.
+                    resolved.setdefault(digest, (record["comment"], index))
+                continue
+
+            if dedup and digest in resolved:
+                duplicates += 1
+                share(index, key, *resolved[digest])
+                continue
+            if dedup and digest in waiting:
+                duplicates += 1
+                waiting[digest].append((index, key))
+                continue
+            if dedup:
+                waiting[digest] = []
+
+            item_stats = {
+                "retrieval_s": retrieval_s,
+                "prompt_s": time.monotonic() - prompt_start,
+                "prompt_chars": len(prompt),
+                "prompt_tokens": estimate_tokens(prompt),
+                "shared_prefix_chars": len(os.path.commonprefix([previous_prompt, prompt])),
+            }
+            previous_prompt = prompt
+            shared_chars += item_stats["shared_prefix_chars"]
+            prompt_chars += len(prompt)
+
+            inflight[executor.submit(generate, index, key, messages)] = (index, key, item_stats, digest)
+            # Block only once the window is full; otherwise just drain whatever has finished.
+            collect(timeout=None if window_full() else 0)
+            while window_full():
+                collect()
+
+        while inflight or refining:
+            collect()
+
+    if cache:
+        print(f"Response cache: {cache.stats()}")
+    if first_line_only:
+        print(f"Early termination: {saved['items']} streams cut after the first line, "
+              f"~{saved['tokens']} tokens and ~{saved['seconds']:.1f}s of decoding saved")
+    print(f"Endpoint limiter: {limiter.summary()}")
+    if refine_client:
+        print(f"Refinement endpoint limiter: {refine_limiter.summary()}")
+        print(f"Refinement stage: max queue depth {max_refine_queue}")
+    if dedup:
+        unique = len(resolved)
+        print(f"Prompt dedup: {unique + duplicates} items, {unique} unique prompts, "
+              f"{duplicates} requests saved ({duplicates / max(unique + duplicates, 1):.1%})")
+    print(f"Prompt layout '{prompt_layout}': {shared_chars / max(prompt_chars, 1):.1%} of prompt characters "
+          f"repeat the previous request's prefix")
+    print(metrics.format_summary())
+    return metrics.summary()
 
 
 # =========================================================
 # Entry Point
 # =========================================================
 
-def main(argv):
+def main(options: dict):
     setup_environment()
-    llm_client, _ = init_clients()
 
-    input_file, output_file = argv
+    input_file = options["--input_file"]
     knowledge_path = "path/to/knowledge.json"  # PLACEHOLDER
-
-    generate_comments(input_file, output_file, knowledge_path, llm_client)
+    knowledge_file = options.get("--knowledge_file")
+    shard = parse_shard(options["--shard"]) if "--shard" in options else None
+    kb_index = options.get("--kb_index")
+
+    if "--prepare_knowledge" in options:
+        prepare_knowledge(input_file, knowledge_path, knowledge_file, shard, kb_index)
+        return
+
+    llm_client, auxiliary_client = init_clients()
+
+    output_file = options["--output_file"]
+    workers = int(options.get("--workers", 1))
+    journal_path = options.get("--journal")
+    resume = "--resume" in options
+
+    cache = None
+    if "--cache" in options:
+        cache = ResponseCache(
+            options["--cache"],
+            max_bytes=int(float(options.get("--cache_max_mb", 1024)) * 1024 * 1024),
+            read_only="--cache_read_only" in options
+        )
+
+    max_tokens = int(options["--max_tokens"]) if "--max_tokens" in options else None
+    refine_workers = int(options.get("--refine_workers", workers))
+
+    def rate(name: str):
+        return float(options[name]) if name in options else None
+
+    limiter = EndpointLimiter(rate("--rpm"), rate("--tpm"), max_concurrency=workers)
+    refine_limiter = EndpointLimiter(rate("--refine_rpm"), rate("--refine_tpm"),
+                                     max_concurrency=refine_workers)
+
+    # Replicas given with --endpoints replace the single client; rate limits
+    # then apply per endpoint.
+    pools = []
+    endpoint_concurrency = int(options.get("--endpoint_concurrency", workers))
+    if "--endpoints" in options:
+        llm_client = EndpointPool.from_urls(options["--endpoints"].split(","), os.getenv("LLM_API_KEY"),
+                                            endpoint_concurrency, rate("--rpm"), rate("--tpm")).start()
+        pools.append(llm_client)
+    if "--refine_endpoints" in options:
+        auxiliary_client = EndpointPool.from_urls(options["--refine_endpoints"].split(","),
+                                                  os.getenv("AUX_LLM_API_KEY"), endpoint_concurrency,
+                                                  rate("--refine_rpm"), rate("--refine_tpm")).start()
+        pools.append(auxiliary_client)
+
+    generate_comments(input_file, output_file, knowledge_path, llm_client,
+                      workers=workers, journal_path=journal_path, resume=resume, cache=cache,
+                      first_line_only="--first_line_only" in options, max_tokens=max_tokens,
+                      metrics_path=options.get("--metrics_file"), knowledge_file=knowledge_file,
+                      refine_client=auxiliary_client if "--refine" in options else None,
+                      refine_workers=refine_workers, limiter=limiter, refine_limiter=refine_limiter,
+                      dedup="--no_dedup" not in options, shard=shard,
+                      prompt_layout=options.get("--prompt_layout", "legacy"), kb_index=kb_index)
+    for pool in pools:
+        pool.close()
 
 
 if __name__ == "__main__":
-    opts, _ = getopt.getopt(sys.argv[1:], "", ["input_file=", "output_file="])
-    args = [v for _, v in opts]
-    main(args)
+    opts, _ = getopt.getopt(sys.argv[1:], "", ["input_file=", "output_file=", "workers=",
+                                               "journal=", "resume",
+                                               "cache=", "cache_max_mb=", "cache_read_only",
+                                               "first_line_only", "max_tokens=", "metrics_file=",
+                                               "knowledge_file=", "prepare_knowledge",
+                                               "refine", "refine_workers=",
+                                               "rpm=", "tpm=", "refine_rpm=", "refine_tpm=",
+                                               "no_dedup", "endpoints=", "refine_endpoints=",
+                                               "endpoint_concurrency=", "shard=", "prompt_layout=",
+                                               "kb_index="])
+    main(dict(opts))
@@ -0,0 +1,77 @@
+import json
+
+CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+
+
+def iter_json_items(path: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Yield dataset items one by one from either a top-level JSON array or a
+    JSONL file, reading the file incrementally so memory stays proportional
+    to a single item rather than to the whole input.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(chunk_size)
+        start = len(head) - len(head.lstrip())
+
+        if head[start:start + 1] == "[":
+            yield from _iter_array(f, head, start + 1, chunk_size)
+        else:
+            yield from _iter_lines(f, head, chunk_size)
+
+
+def _iter_lines(f, head: str, chunk_size: int):
+    pending = head
+    while True:
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+
+    if pending.strip():
+        yield json.loads(pending)
+
+
+def _iter_array(f, buffer: str, pos: int, chunk_size: int):
+    eof = False
+    while True:
+        # Skip separators between elements.
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            buffer, pos = _refill(f, buffer, pos, chunk_size)
+            eof = pos == len(buffer)
+
+        if pos >= len(buffer):
+            raise ValueError("Unterminated JSON array")
+        if buffer[pos] == "]":
+            return
+
+        try:
+            item, end = _decoder.raw_decode(buffer, pos)
+            # A value not yet followed by a delimiter (e.g. a number) may still continue.
+            complete = eof or (end < len(buffer) and buffer[end] in " \t\r\n,]")
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+
+        if complete:
+            pos = end
+            yield item
+        else:
+            before = len(buffer) - pos
+            buffer, pos = _refill(f, buffer, pos, chunk_size)
+            eof = len(buffer) - pos == before
+
+
+def _refill(f, buffer: str, pos: int, chunk_size: int):
+    return buffer[pos:] + f.read(chunk_size), 0
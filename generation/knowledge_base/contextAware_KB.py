@@ -1,129 +1,1138 @@
+import os
 import json
 import re
+import zlib
 import inspect
+import threading
+import mmap
+import bisect
+import functools
+import warnings
 import numpy as np
 
 from pathlib import Path
-from collections import defaultdict
+from collections import defaultdict, Counter, deque, OrderedDict, ChainMap
 from typing import List, Dict, Set
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from scipy.sparse import csr_matrix, issparse
+from scipy.sparse import csr_matrix, vstack
+
+SNAPSHOT_SUFFIX = ".snapshot.npz"
+SNAPSHOT_VERSION = 3
+# Deleted entries are compacted away once they exceed this share of the KB.
+COMPACT_RATIO = 0.25
+# Appended rows are merged into the main matrix once they exceed this share of it.
+TAIL_RATIO = 0.125
+# Postings and terms changed since the last full publish are kept in a small
+# layer (new terms matched by plain substring tests) until this many pile up.
+MAX_PENDING_TERMS = 1024
+INDEX_MAGIC = b"KBINDEX\0"
+INDEX_VERSION = 2
+INDEX_ALIGNMENT = 64
+# Automaton edges are keyed node * CHAR_RANGE + code point.
+CHAR_RANGE = 0x110000
+
+
+def _string_table(strings: List[str], lookup: bool = False) -> Dict[str, np.ndarray]:
+    """
+    Strings as a UTF-8 buffer with byte offsets, a pickle-free layout, plus
+    (with `lookup`) an open-addressing table of string ids keyed on crc32,
+    for MappedStrings.
+    """
+    encoded = [string.encode("utf-8") for string in strings]
+    table = {"bytes": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+             "offsets": np.cumsum([0] + [len(raw) for raw in encoded], dtype=np.int64)}
+    if lookup:
+        slots = np.full(1 << max(2 * len(encoded) - 1, 1).bit_length(), -1, dtype=np.int32)
+        mask = len(slots) - 1
+        for i, raw in enumerate(encoded):
+            slot = zlib.crc32(raw) & mask
+            while slots[slot] >= 0:
+                slot = (slot + 1) & mask
+            slots[slot] = i
+        table["slots"] = slots
+    return table
+
+
+def _unpack_strings(buffer: np.ndarray, offsets: np.ndarray) -> List[str]:
+    """The strings of a _string_table, as a list."""
+    raw = buffer.tobytes()
+    offsets = offsets.tolist()
+    return [raw[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+
+def _tfidf_vectorizer(**params):
+    # scikit-learn takes over a second to import; only fitting needs it.
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    return TfidfVectorizer(**params)
+
+
+def _tfidf_rows(documents: List[str], column_counts, idf, width: int) -> csr_matrix:
+    """
+    One l2-normalized tf-idf row per document, shared by both vectorizers:
+    `column_counts(document)` gives {column: count} and `idf(columns)` the
+    weights of the sorted columns.
+    """
+    indices, data, indptr = [], [], [0]
+    for document in documents:
+        counts = column_counts(document)
+        columns = sorted(counts)
+        weights = np.array([counts[c] for c in columns], dtype=np.float64) * idf(columns)
+        norm = np.sqrt(np.dot(weights, weights))
+        indices.extend(columns)
+        data.extend(weights / norm if norm else weights)
+        indptr.append(len(indices))
+    return csr_matrix((np.array(data, dtype=np.float64), np.array(indices, dtype=np.int32), indptr),
+                      shape=(len(documents), width))
+
+
+class FrozenTfidfVectorizer:
+    """
+    Transform-only copy of a fitted TfidfVectorizer with default analysis
+    settings (word unigrams, raw counts, idf weighting, l2 norm) apart from
+    `token_pattern` and `lowercase`, which are replayed. Produces the same
+    vectors as the original without importing scikit-learn.
+    """
+
+    TOKEN_PATTERN = r"(?u)\b\w\w+\b"
+    DEFAULTS = {"analyzer": "word", "binary": False, "lowercase": True, "ngram_range": (1, 1),
+                "norm": "l2", "preprocessor": None, "smooth_idf": True, "stop_words": None,
+                "strip_accents": None, "sublinear_tf": False, "token_pattern": TOKEN_PATTERN,
+                "tokenizer": None, "use_idf": True}
+    REPLAYED = ("token_pattern", "lowercase")
+
+    def __init__(self, vocabulary: Dict[str, int], idf: np.ndarray, token_pattern: str = TOKEN_PATTERN,
+                 lowercase: bool = True):
+        self.vocabulary_ = vocabulary
+        self.idf_ = idf
+        self.token_pattern = token_pattern
+        self.lowercase = lowercase
+        self._token = re.compile(token_pattern)
+
+    @classmethod
+    def from_fitted(cls, vectorizer):
+        if isinstance(vectorizer, cls):
+            return vectorizer
+        params = vectorizer.get_params()
+        unsupported = [k for k, v in cls.DEFAULTS.items()
+                       if k not in cls.REPLAYED and tuple(np.ravel(params.get(k))) != tuple(np.ravel(v))]
+        if unsupported or params.get("token_pattern") is None:
+            raise ValueError(f"Cannot freeze a vectorizer with non-default settings: {unsupported or ['token_pattern']}")
+        return cls(dict(vectorizer.vocabulary_), np.asarray(vectorizer.idf_, dtype=np.float64),
+                   params["token_pattern"], bool(params["lowercase"]))
+
+    def get_params(self):
+        return {**self.DEFAULTS, "token_pattern": self.token_pattern, "lowercase": self.lowercase}
+
+    def _counts(self, document: str) -> Counter:
+        text = document.lower() if self.lowercase else document
+        columns = (self.vocabulary_.get(token) for token in self._token.findall(text))
+        return Counter(column for column in columns if column is not None)
+
+    def transform(self, documents: List[str]) -> csr_matrix:
+        return _tfidf_rows(documents, self._counts, self.idf_.__getitem__, len(self.idf_))
+
+
+class AhoCorasick:
+    """
+    Multi-pattern substring matcher: `find_all` returns every pattern that
+    occurs in a text in one pass over the text, however many patterns there are.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]   # pattern ending at this node
+        self.next_output = [0]  # nearest node on the fail chain with an output (0 = none)
+
+        for pattern in patterns:
+            node = 0
+            for char in pattern:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto[node][char] = child
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                    self.next_output.append(0)
+                node = child
+            self.output[node] = pattern
+
+        # Breadth-first: fail links of a node only depend on shallower nodes.
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.next_output[child] = target if self.output[target] is not None else self.next_output[target]
+                queue.append(child)
+
+    def find_all(self, text: str) -> Set[str]:
+        goto, fail, output, next_output = self.goto, self.fail, self.output, self.next_output
+        found = {output[0]} if output[0] is not None else set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            match = node if output[node] is not None else next_output[node]
+            while match:
+                found.add(output[match])
+                match = next_output[match]
+        return found
+
+
+class HashingTfidfVectorizer:
+    """
+    Stateless TF-IDF backend: tokens (analysed like FrozenTfidfVectorizer)
+    are hashed into a fixed space of `n_features` columns, so there is no fit
+    step, no vocabulary, and new words are never dropped. IDF comes from
+    document-frequency counters updated as documents are added and removed.
+    """
+
+    def __init__(self, n_features: int = 1 << 20, df: np.ndarray = None, n_documents: int = 0):
+        self.n_features = n_features
+        self.df = np.zeros(n_features, dtype=np.int32) if df is None else df
+        self.n_documents = n_documents
+        self._token = re.compile(FrozenTfidfVectorizer.TOKEN_PATTERN)
+
+    def _features(self, document: str) -> Counter:
+        # crc32 rather than hash(): it must not change between processes.
+        return Counter(zlib.crc32(token.encode("utf-8")) % self.n_features
+                       for token in self._token.findall(document.lower()))
+
+    def partial_fit(self, documents: List[str], sign: int = 1):
+        for document in documents:
+            columns = np.fromiter(self._features(document), dtype=np.int64)
+            self.df[columns] += sign
+            self.n_documents += sign
+        return self
+
+    def remove(self, documents: List[str]):
+        return self.partial_fit(documents, sign=-1)
+
+    def copy(self):
+        return HashingTfidfVectorizer(self.n_features, self.df.copy(), self.n_documents)
+
+    def get_params(self):
+        return {"n_features": self.n_features}
+
+    def _idf(self, columns: List[int]) -> np.ndarray:
+        # Smoothed idf, as in TfidfVectorizer; only the columns present are computed.
+        return np.log((1.0 + self.n_documents) / (1.0 + self.df[columns])) + 1.0
+
+    def transform(self, documents: List[str]) -> csr_matrix:
+        return _tfidf_rows(documents, self._features, self._idf, self.n_features)
+
+
+VECTORIZER_BACKENDS = ("tfidf", "hashing")
+
+
+class IndexSnapshot:
+    """
+    Immutable view of everything a search reads: the vectorizer, the
+    row-normalized CSR index, the term postings and the term matchers. A KB
+    publishes a new snapshot after each change instead of mutating this
+    one, so any number of threads can search a snapshot without locking.
+    """
+
+    def __init__(self, version: int, vectorizer, matrix: csr_matrix, tail: tuple, term_index: Dict[str, frozenset],
+                 token_terms: Dict[str, tuple], automaton: AhoCorasick, entries: list, size: int,
+                 recent_terms: tuple = ()):
+        self.version = version
+        self.vectorizer = vectorizer
+        # Rows appended since the last merge follow the main matrix as a few small blocks.
+        self.matrix = matrix
+        self.tail = tail
+        # Entries past the vectorized rows (left by a failed index update) are not searchable yet.
+        self.rows = matrix.shape[0] + sum(block.shape[0] for block in tail)
+        self.term_index = term_index
+        self.token_terms = token_terms
+        self.automaton = automaton
+        # The KB's entry list, shared: entries are only ever appended to it and
+        # a compaction builds a new list, so indices below `size` stay valid.
+        self.entries = entries
+        self.size = size
+        # Terms added since `automaton` was built.
+        self.recent_terms = recent_terms
+
+    def fuzzy_term_match(self, text: str):
+        matched_terms = self.automaton.find_all(text)
+        matched_terms.update(term for term in self.recent_terms if term in text)
+        tokenized = set(re.findall(r'[\w\u4e00-\u9fff]+', text))
+
+        # Only terms sharing a token with the query can reach half of their tokens.
+        shared = Counter()
+        for token in tokenized:
+            shared.update(self.token_terms.get(token, ()))
+        for (term, term_token_count), hits in shared.items():
+            if hits / term_token_count >= 0.5:
+                matched_terms.add(term)
+
+        return matched_terms
+
+    def candidates(self, candidate_terms: Set[str]) -> np.ndarray:
+        candidate_indices = set()
+        for term in candidate_terms:
+            candidate_indices.update(self.term_index.get(term, ()))
+        indices = np.array(sorted(candidate_indices), dtype=np.int64)
+        return indices[:np.searchsorted(indices, self.rows)]
+
+    @staticmethod
+    def top_n(indices: np.ndarray, sims: np.ndarray, top_n: int, similarity_threshold: float):
+        """
+        (similarity, index) pairs of the `top_n` best candidates, best first;
+        ties in similarity are broken by entry order.
+        """
+        keep = sims >= similarity_threshold
+        indices, sims = indices[keep], sims[keep]
+        if len(sims) > top_n > 0:
+            # Keep everything tied with the n-th best score so the tie-break stays exact.
+            kth = sims[np.argpartition(-sims, top_n - 1)[top_n - 1]]
+            keep = sims >= kth
+            indices, sims = indices[keep], sims[keep]
+        order = np.lexsort((indices, -sims))[:max(top_n, 0)]
+        return [(sims[i], indices[i]) for i in order]
+
+    def _split(self, rows: np.ndarray):
+        """(block, rows within it) for each block holding some of the ascending `rows`."""
+        start = 0
+        for block in (self.matrix, *self.tail):
+            lo, hi = np.searchsorted(rows, [start, start + block.shape[0]])
+            if hi > lo:
+                yield block, rows[lo:hi] - start
+            start += block.shape[0]
+
+    def select(self, rows: np.ndarray) -> csr_matrix:
+        """The given ascending index rows as one CSR matrix."""
+        if not self.tail:
+            return self.matrix[rows]
+        return vstack([block[block_rows] for block, block_rows in self._split(rows)]).tocsr()
+
+    def row_dots(self, rows: np.ndarray, query_vec: csr_matrix) -> np.ndarray:
+        """
+        Dot products of the given ascending index rows with one normalized
+        query, computed straight from the CSR arrays of the candidate rows.
+        """
+        if not len(query_vec.indices):
+            return np.zeros(len(rows))
+        return np.concatenate([self._block_dots(block, block_rows, query_vec)
+                               for block, block_rows in self._split(rows)] or [np.zeros(0)])
+
+    @staticmethod
+    def _block_dots(matrix: csr_matrix, rows: np.ndarray, query_vec: csr_matrix) -> np.ndarray:
+        starts = matrix.indptr[rows]
+        lengths = matrix.indptr[rows + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        columns = matrix.indices[offsets]
+
+        query_columns, query_values = query_vec.indices, query_vec.data
+        positions = np.minimum(np.searchsorted(query_columns, columns), len(query_columns) - 1)
+        products = np.where(query_columns[positions] == columns, matrix.data[offsets] * query_values[positions], 0.0)
+        return np.bincount(np.repeat(np.arange(len(rows)), lengths), weights=products, minlength=len(rows))
+
+    def normalized_queries(self, queries: List[str]) -> csr_matrix:
+        try:
+            query_vecs = self.vectorizer.transform(queries)
+        except ValueError:
+            query_vecs = csr_matrix((len(queries), self.matrix.shape[1]))
+        norms = np.sqrt(np.asarray(query_vecs.multiply(query_vecs).sum(axis=1)).ravel())
+        scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        return csr_matrix(query_vecs.multiply(scale[:, None]))
+
+    def search_one(self, query: str, top_n: int, similarity_threshold: float):
+        if not self.size:
+            return []
+
+        candidate_terms = self.fuzzy_term_match(query)
+        indices = self.candidates(candidate_terms)
+        if not len(indices):
+            return []
+
+        # One sparse mat-vec over the candidate rows only.
+        query_vec = self.normalized_queries([query])
+        query_vec.sort_indices()
+        sims = self.row_dots(indices, query_vec)
+
+        top_results = self.top_n(indices, sims, top_n, similarity_threshold)
+        return self.collect_terms(top_results, candidate_terms)
+
+    def search_block(self, queries: List[str], top_n: int, similarity_threshold: float):
+        matched = [self.fuzzy_term_match(query) for query in queries]
+        candidates = [self.candidates(terms) for terms in matched]
+        rows = np.unique(np.concatenate(candidates)) if candidates else np.zeros(0, dtype=np.int64)
+        if not len(rows):
+            return [[] for _ in queries]
+
+        block = (self.normalized_queries(queries) @ self.select(rows).T).toarray()
+
+        results = []
+        for row, (candidate_terms, indices) in enumerate(zip(matched, candidates)):
+            if not len(indices):
+                results.append([])
+                continue
+
+            sims = block[row, np.searchsorted(rows, indices)]
+            top_results = self.top_n(indices, sims, top_n, similarity_threshold)
+            results.append(self.collect_terms(top_results, candidate_terms))
+
+        return results
+
+    def collect_terms(self, top_results, candidate_terms: Set[str]):
+        term_pool = defaultdict(list)
+        for sim, idx in top_results:
+            entry = self.entries[idx]
+            valid_terms = {
+                cn: en for cn, en in entry["terms"].items()
+                if cn in candidate_terms
+            }
+            for cn, en in valid_terms.items():
+                term_pool[cn].append((en, sim))
+
+        final_results = []
+        for cn, candidates in term_pool.items():
+            best_trans = max(candidates, key=lambda x: x[1])[0]
+            final_results.append({
+                "source_term": cn,
+                "target_term": best_trans
+            })
+
+        return final_results
+
+    def __getstate__(self):
+        # Only the entries this snapshot can see travel with it.
+        state = dict(self.__dict__)
+        state["entries"] = self.entries[:self.size]
+        return state
+
+
+class MappedStrings:
+    """Read-only view of a string table written by _string_table."""
+
+    def __init__(self, buffer: memoryview, offsets: memoryview, slots: memoryview = None):
+        self.buffer = buffer
+        self.offsets = offsets
+        self.slots = slots
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i: int) -> str:
+        return self.raw(i).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def find(self, string: str) -> int:
+        """Id of `string`, or -1."""
+        raw = string.encode("utf-8")
+        mask = len(self.slots) - 1
+        slot = zlib.crc32(raw) & mask
+        while self.slots[slot] >= 0:
+            if self.raw(self.slots[slot]) == raw:
+                return self.slots[slot]
+            slot = (slot + 1) & mask
+        return -1
+
+
+class MappedVocabulary:
+    """token -> column, read from a mapped string table."""
+
+    def __init__(self, tokens: MappedStrings, columns: memoryview):
+        self.tokens = tokens
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def get(self, token: str, default=None):
+        i = self.tokens.find(token)
+        return self.columns[i] if i >= 0 else default
+
+
+class MappedPostings:
+    """term -> entry indices; the mapped counterpart of IndexSnapshot.term_index."""
+
+    def __init__(self, terms: MappedStrings, offsets: memoryview, postings: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.postings = postings
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def get(self, term: str, default=()):
+        i = self.terms.find(term)
+        if i < 0:
+            return default
+        return self.postings[self.offsets[i]:self.offsets[i + 1]].tolist()
+
+
+class MappedTokenTerms:
+    """token -> ((term, number of distinct tokens in the term), ...)."""
+
+    def __init__(self, tokens: MappedStrings, offsets: memoryview, term_ids: memoryview,
+                 token_counts: memoryview, terms: MappedStrings):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.term_ids = term_ids
+        self.token_counts = token_counts
+        self.terms = terms
+
+    def get(self, token: str, default=()):
+        i = self.tokens.find(token)
+        if i < 0:
+            return default
+        return [(self.terms[self.term_ids[j]], self.token_counts[j])
+                for j in range(self.offsets[i], self.offsets[i + 1])]
+
+
+class MappedAutomaton:
+    """
+    AhoCorasick with its trie flattened into arrays: the edges sorted by
+    (node, character) key, and fail / output / next_output per node.
+    """
+
+    def __init__(self, edge_keys: memoryview, edge_targets: memoryview, fail: memoryview,
+                 output: memoryview, next_output: memoryview, terms: MappedStrings):
+        self.edge_keys = edge_keys
+        self.edge_targets = edge_targets
+        self.fail = fail
+        self.output = output
+        self.next_output = next_output
+        self.terms = terms
+
+    @staticmethod
+    def arrays(automaton: AhoCorasick, term_ids: Dict[str, int]) -> Dict[str, np.ndarray]:
+        edges = sorted((node * CHAR_RANGE + ord(char), child)
+                       for node, children in enumerate(automaton.goto) for char, child in children.items())
+        return {
+            "edge_keys": np.array([key for key, _ in edges], dtype=np.int64),
+            "edge_targets": np.array([child for _, child in edges], dtype=np.int32),
+            "fail": np.array(automaton.fail, dtype=np.int32),
+            "output": np.array([-1 if pattern is None else term_ids[pattern] for pattern in automaton.output],
+                               dtype=np.int32),
+            "next_output": np.array(automaton.next_output, dtype=np.int32),
+        }
+
+    def _goto(self, node: int, char: str) -> int:
+        key = node * CHAR_RANGE + ord(char)
+        i = bisect.bisect_left(self.edge_keys, key)
+        return self.edge_targets[i] if i < len(self.edge_keys) and self.edge_keys[i] == key else -1
+
+    def find_all(self, text: str) -> Set[str]:
+        fail, output, next_output = self.fail, self.output, self.next_output
+        found = {self.terms[output[0]]} if output[0] >= 0 else set()
+        node = 0
+        for char in text:
+            child = self._goto(node, char)
+            while node and child < 0:
+                node = fail[node]
+                child = self._goto(node, char)
+            node = max(child, 0)
+            match = node if output[node] >= 0 else next_output[node]
+            while match:
+                found.add(self.terms[output[match]])
+                match = next_output[match]
+        return found
+
+
+class MappedEntries:
+    """The KB entries ({"context", "terms"}) read from a mapped index."""
+
+    def __init__(self, contexts: MappedStrings, term_offsets: memoryview, term_ids: memoryview,
+                 targets: MappedStrings, terms: MappedStrings):
+        self.contexts = contexts
+        self.term_offsets = term_offsets
+        self.term_ids = term_ids
+        self.targets = targets
+        self.terms = terms
+
+    def __len__(self) -> int:
+        return len(self.contexts)
+
+    def __getitem__(self, i: int) -> dict:
+        span = range(self.term_offsets[i], self.term_offsets[i + 1])
+        return {"context": self.contexts[i],
+                "terms": {self.terms[self.term_ids[j]]: self.targets[j] for j in span}}
+
+
+class MappedIndexSnapshot(IndexSnapshot):
+    """
+    An IndexSnapshot whose arrays all live in a file written by
+    ContextAwareKnowledgeBase.save_index, mapped read-only. Nothing is
+    copied or rebuilt on attach, so every process attached to the same file
+    shares one copy of the index through the page cache (put the file on
+    /dev/shm to keep it in shared memory). Pickles as its path.
+    """
+
+    def __init__(self, filepath: str, version: int = 0):
+        with open(filepath, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f"{filepath} is not a KB index")
+        header_size = int.from_bytes(self._map[len(INDEX_MAGIC):len(INDEX_MAGIC) + 8], "little")
+        start = len(INDEX_MAGIC) + 8
+        self.header = json.loads(self._map[start:start + header_size].decode("utf-8"))
+        self._base = start + header_size + -(start + header_size) % INDEX_ALIGNMENT
+        if self.header["format_version"] != INDEX_VERSION:
+            raise ValueError(f"Unsupported KB index version {self.header['format_version']} in {filepath} "
+                             f"(expected {INDEX_VERSION})")
+        self.path = filepath
+
+        array, view = self._array, self._view
+
+        def strings(name: str, lookup: bool = False) -> MappedStrings:
+            return MappedStrings(view(name + "_bytes"), view(name + "_offsets"),
+                                 view(name + "_slots") if lookup else None)
+
+        terms = strings("terms", lookup=True)
+        if self.header["backend"] == "hashing":
+            vectorizer = HashingTfidfVectorizer(self.header["n_features"], array("hash_df"),
+                                                self.header["n_documents"])
+        else:
+            vectorizer = FrozenTfidfVectorizer(MappedVocabulary(strings("vocabulary", lookup=True),
+                                                                view("vocabulary_columns")), array("idf"),
+                                               self.header["token_pattern"], self.header["lowercase"])
+        matrix = csr_matrix((array("data"), array("indices"), array("indptr")), shape=tuple(self.header["shape"]))
+        super().__init__(
+            version, vectorizer, matrix, (),
+            MappedPostings(terms, view("posting_offsets"), array("postings")),
+            MappedTokenTerms(strings("tokens", lookup=True), view("token_offsets"), view("token_term_ids"),
+                             view("token_term_counts"), terms),
+            MappedAutomaton(view("edge_keys"), view("edge_targets"), view("fail"), view("output"),
+                            view("next_output"), terms),
+            MappedEntries(strings("contexts"), view("entry_term_offsets"), view("entry_term_ids"),
+                          strings("targets"), terms),
+            self.header["size"],
+        )
+
+    @property
+    def source(self) -> str:
+        return self.header["source"]
+
+    def _array(self, name: str) -> np.ndarray:
+        dtype, count, offset = self.header["arrays"][name]
+        return np.frombuffer(self._map, dtype=dtype, count=count, offset=self._base + offset)
+
+    def _view(self, name: str) -> memoryview:
+        # Scalar reads from a memoryview are much cheaper than from numpy.
+        dtype, count, offset = self.header["arrays"][name]
+        start = self._base + offset
+        return memoryview(self._map)[start:start + count * np.dtype(dtype).itemsize].cast(np.dtype(dtype).char)
+
+    @staticmethod
+    def write(filepath: str, arrays: Dict[str, np.ndarray], **header):
+        """
+        Layout: INDEX_MAGIC, the JSON header's length (8 bytes, little
+        endian), the header, then every array aligned to INDEX_ALIGNMENT
+        bytes at the offset the header gives relative to the first one.
+        """
+        layout, offset = {}, 0
+        for name, values in arrays.items():
+            offset += -offset % INDEX_ALIGNMENT
+            layout[name] = [values.dtype.str, len(values), offset]
+            offset += values.nbytes
+        encoded = json.dumps({"format_version": INDEX_VERSION, **header, "arrays": layout}).encode("utf-8")
+
+        partial_path = f"{filepath}.partial.{os.getpid()}"
+        with open(partial_path, "wb") as f:
+            f.write(INDEX_MAGIC)
+            f.write(len(encoded).to_bytes(8, "little"))
+            f.write(encoded)
+            base = f.tell() + -f.tell() % INDEX_ALIGNMENT
+            for name, values in arrays.items():
+                f.write(b"\0" * (base + layout[name][2] - f.tell()))
+                f.write(np.ascontiguousarray(values).tobytes())
+        os.replace(partial_path, filepath)
+
+    def __reduce__(self):
+        return MappedIndexSnapshot, (self.path, self.version)
+
+
+def _exclusive(method):
+    """
+    Run a KB method under its writer lock, and publish what it changed
+    before the outermost such call releases the lock. Searches never take it.
+    """
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self._write_lock:
+            self._writers += 1
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                try:
+                    if self._writers == 1:
+                        self._refresh()
+                finally:
+                    self._writers -= 1
+    return locked
+
+
+def _mutating(method):
+    """_exclusive, for methods that need the KB's own (not attached) state."""
+    @functools.wraps(method)
+    def checked(self, *args, **kwargs):
+        if self._mapped is not None:
+            raise ValueError(f"{method.__name__}: the KB is attached read-only to {self._mapped.path}")
+        return method(self, *args, **kwargs)
+    return _exclusive(checked)
+
+
+# Set in each process of a search_many pool.
+_worker_snapshot = None
+
+
+def _init_search_worker(snapshot: IndexSnapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def _search_worker_chunk(job):
+    queries, top_n, similarity_threshold = job
+    return _worker_snapshot.search_block(queries, top_n, similarity_threshold)
 
 
 class ContextAwareKnowledgeBase:
-    def __init__(self, filepath: str = None):
-        self.vectorizer = TfidfVectorizer(min_df=1, token_pattern=r'(?u)\b\w+\b')
+    """
+    Context-aware term knowledge base with TF-IDF retrieval.
+
+    Searches read the current IndexSnapshot without locking; every change
+    runs under a writer lock and publishes a new snapshot before releasing it.
+    """
+
+    def __init__(self, filepath: str = None, refit_threshold: float = 0.1, background_refit: bool = True,
+                 cache_size: int = 4096, backend: str = "tfidf", hashing_features: int = 1 << 20):
+        if backend not in VECTORIZER_BACKENDS:
+            raise ValueError(f"Unknown vectorizer backend {backend!r}, expected one of {VECTORIZER_BACKENDS}")
+        # "tfidf" (fitted vocabulary) or "hashing" (no fit; a refit only re-weights rows).
+        self.backend = backend
+        self.hashing_features = hashing_features
+        # Refit once entries added/deleted since the last fit exceed this share (None: never).
+        self.refit_threshold = refit_threshold
+        self.background_refit = background_refit
+        # LRU cache of search results, emptied whenever `version` changes.
+        self.cache_size = cache_size
+        self.version = 0
+        self._cache = OrderedDict()
+        self._cache_version = 0
+        self._cache_stats = {"hits": 0, "misses": 0}
+        self._cache_lock = threading.Lock()
         self.knowledge = []
         self.term_index = defaultdict(set)
-        self.vectorizer = TfidfVectorizer()
+        # tfidf: created on first fit, or restored frozen from a snapshot.
+        self.vectorizer = HashingTfidfVectorizer(hashing_features) if backend == "hashing" else None
         self.filepath = Path(filepath) if filepath else None
         self._dirty = True
+        self._matrix = csr_matrix((0, 0))
+        self._norms = np.zeros(0)
+        # (rows, norms) blocks appended after self._matrix; see _append_rows.
+        self._tail = []
+        # Substring matcher over the term_index keys, rebuilt on publish once
+        # MAX_PENDING_TERMS were added since (None: rebuild at the next publish).
+        self._automaton = None
+        self._new_terms = None
+        self._new_tokens = set()
+        # token -> [(term, number of distinct tokens in the term)], kept in step with term_index.
+        self._token_terms = defaultdict(list)
+        # context -> indices of the live entries with that context, for O(1) dedupe and delete.
+        self._context_index = {}
+        # Deleted entry indices; their rows stay in place until _compact.
+        self._tombstones = set()
+        # Entries at the last fit, entries added/deleted since, and bumped on
+        # every renumbering (or newer refit) so a refit started before one is discarded.
+        self._fit_size = 0
+        self._changes = 0
+        self._layout = 0
+        self._refit_id = 0
+        self._refit_thread = None
+        self._refit_result = None
+        # Terms whose postings changed since the last publish (None: all of
+        # them), and the frozen postings shared by published snapshots.
+        self._touched_terms = None
+        self._postings = {}
+        self._pending_postings = {}
+        self._token_base = {}
+        self._snapshot = None
+        self._write_lock = threading.RLock()
+        self._writers = 0
+        # The MappedIndexSnapshot this KB is attached to, if any.
+        self._mapped = None
 
+        self._publish()
         if filepath and self.filepath.exists():
             self.load(filepath)
 
     def _safe_fit(self, contexts: List[str]):
+        self._fit_size, self._changes = len(contexts), 0
+        if self.vectorizer is None:
+            self.vectorizer = _tfidf_vectorizer()
         if isinstance(self.vectorizer.dtype, str):
             if 'float64' in self.vectorizer.dtype:
                 self.vectorizer.dtype = np.float64
         self.vectorizer.fit(contexts)
+        try:
+            # Queries are then transformed without scikit-learn's per-call overhead.
+            self.vectorizer = FrozenTfidfVectorizer.from_fitted(self.vectorizer)
+        except ValueError:
+            pass
 
+    @_mutating
     def add_entry(self, context: str, terms: Dict[str, str]):
         if not re.search(r'\w', context):
             raise ValueError("Context must contain valid tokens")
 
-        if any(entry["context"] == context for entry in self.knowledge):
+        if context in self._context_index:
             return
 
         entry = {
             "context": context,
-            "terms": terms,
-            "vector": None
+            "terms": terms
         }
         self.knowledge.append(entry)
+        self._context_index[context] = [len(self.knowledge) - 1]
+        if self.backend == "hashing":
+            self.vectorizer.partial_fit([context])
+        self.version += 1
 
         for term in terms:
+            if term not in self.term_index:
+                self._index_term(term)
             self.term_index[term].add(len(self.knowledge) - 1)
+            self._touch(term)
 
+        self._changes += 1
         self._dirty = True
 
     def _rebuild_vectors(self):
-        contexts = [entry["context"] for entry in self.knowledge]
+        if not self.knowledge:
+            self._set_index(csr_matrix((0, 0)))
+            self._dirty = False
+            return
 
-        if not contexts:
+        if not self._fitted():
+            self._safe_fit([entry["context"] for entry in self.knowledge])
+        elif self._matrix.shape[1] == self._width():
+            # Fitted already: only entries added since need vectors.
+            added = self.knowledge[self._row_count():]
+            if added:
+                self._append_rows(self.vectorizer.transform([entry["context"] for entry in added]))
             self._dirty = False
             return
 
-        if not hasattr(self.vectorizer, "vocabulary_"):
-            self._safe_fit(contexts)
+        self._set_index(self.vectorizer.transform([entry["context"] for entry in self.knowledge]))
+        self._dirty = False
 
-        vectors = self.vectorizer.transform(contexts)
+    def _row_count(self) -> int:
+        return self._matrix.shape[0] + sum(block.shape[0] for block, _ in self._tail)
 
-        for i, vec in enumerate(vectors):
-            self.knowledge[i]["vector"] = csr_matrix(vec)
+    def _append_rows(self, vectors: csr_matrix):
+        """
+        Add rows as a new tail block. The newest blocks are merged while they
+        are no larger than the one before (like a binary counter), so the tail
+        stays a handful of blocks and each row is copied O(log n) times; the
+        tail itself joins the main matrix past TAIL_RATIO of its size.
+        """
+        self._tail.append(self._normalize(vectors))
+        while len(self._tail) > 1 and self._tail[-2][0].shape[0] <= self._tail[-1][0].shape[0]:
+            self._tail[-2:] = [self._stack(self._tail[-2:])]
+        if self._row_count() - self._matrix.shape[0] > TAIL_RATIO * self._matrix.shape[0]:
+            self._merge_tail()
 
-        self._dirty = False
+    def _merge_tail(self):
+        if self._tail:
+            self._matrix, self._norms = self._stack([(self._matrix, self._norms)] + self._tail)
+            self._tail = []
 
-    def search(self, query: str, top_n: int = 9, similarity_threshold: float = 0):
+    @staticmethod
+    def _stack(blocks: list):
+        matrix = vstack([block for block, _ in blocks]).tocsr()
+        matrix.sort_indices()
+        return matrix, np.concatenate([norms for _, norms in blocks])
+
+    def _fitted(self) -> bool:
+        return self.backend == "hashing" or hasattr(self.vectorizer, "vocabulary_")
+
+    def _width(self) -> int:
+        return self.vectorizer.n_features if self.backend == "hashing" else len(self.vectorizer.vocabulary_)
+
+    def _drifted(self) -> bool:
+        return (self.refit_threshold is not None and self._fitted()
+                and self._changes > self.refit_threshold * max(self._fit_size, 1))
+
+    @_mutating
+    def refit(self, wait: bool = True):
+        """
+        Refit vocabulary and IDF on the live entries and rebuild the index
+        (hashing backend: re-weight the rows with the current document
+        frequencies). With `wait=False` the work runs in a background thread and is
+        published when it finishes; at most one runs at a time. A waiting refit
+        never joins that thread (it needs this lock to publish), but supersedes it.
+        """
+        if not wait and self._refit_thread and self._refit_thread.is_alive():
+            return
+        contexts = [entry["context"] for entry in self.knowledge]
+        live = [c for i, c in enumerate(contexts) if i not in self._tombstones]
+        hashing = self.vectorizer.copy() if self.backend == "hashing" else None
+        self._refit_id += 1
+        job = (contexts, live, (self._layout, self._refit_id), hashing)
+        if not wait:
+            self._refit_thread = threading.Thread(target=self._background_refit, args=job, daemon=True)
+            self._refit_thread.start()
+            return
+        self._apply_refit(self._run_refit(*job))
+
+    def _run_refit(self, contexts: List[str], live: List[str], ticket: tuple, vectorizer=None) -> tuple:
+        if vectorizer is None and not live:
+            # Nothing left to fit on: an empty index, as _rebuild_vectors keeps for an empty KB.
+            return None, csr_matrix((len(contexts), 0)), 0, ticket
+        if vectorizer is None:
+            vectorizer = _tfidf_vectorizer()
+            vectorizer.fit(live)
+            try:
+                vectorizer = FrozenTfidfVectorizer.from_fitted(vectorizer)
+            except ValueError:
+                pass
+        return vectorizer, vectorizer.transform(contexts), len(live), ticket
+
+    def _background_refit(self, *job):
+        try:
+            result = self._run_refit(*job)
+        except Exception as exc:
+            result = exc  # reported by whichever call applies it
+        # A single assignment, so a writer sees either nothing or the whole result.
+        self._refit_result = result
+        self._apply_background_refit()
+
+    @_exclusive
+    def _apply_background_refit(self):
+        # Published on the way out, like any other change.
+        self._apply_refit()
+
+    def _apply_refit(self, result=None):
+        if result is None:
+            result, self._refit_result = self._refit_result, None
+        if result is None:
+            return
+        if isinstance(result, Exception):
+            warnings.warn(f"background refit failed: {result!r}", RuntimeWarning)
+            self._changes = 0  # retried once the KB has drifted again
+            return
+        vectorizer, vectors, fit_size, ticket = result
+        if ticket != (self._layout, self._refit_id):
+            return  # renumbered or superseded meanwhile; a new refit follows if still needed
+
+        added = self.knowledge[vectors.shape[0]:]
+        if self.backend == "hashing":
+            vectorizer = self.vectorizer  # the live counters already include later changes
+        self.vectorizer = vectorizer
+        self._set_index(vectors)
+        if added and vectorizer is not None:
+            self._append_rows(vectorizer.transform([entry["context"] for entry in added]))
+        self._fit_size, self._changes = fit_size, len(added)
+        # Without a vectorizer, entries added since are fitted on by the next rebuild.
+        self._dirty = vectorizer is None and bool(added)
+        self.version += 1
+
+    def _maintain_index(self):
+        """Housekeeping before a publish: swap, compact, append, refit."""
+        self._apply_refit()
+        self._maybe_compact()
         if self._dirty:
             self._rebuild_vectors()
+        if self._drifted():
+            self.refit(wait=not self.background_refit)
 
-        if not hasattr(self.vectorizer, "vocabulary_") or not self.vectorizer.vocabulary_:
-            self._rebuild_vectors()
+    def _touch(self, term: str):
+        if self._touched_terms is not None:
+            self._touched_terms.add(term)
+
+    def _read_snapshot(self) -> IndexSnapshot:
+        return self._snapshot
 
+    def _refresh(self):
+        """Bring the index up to date and publish it if anything changed."""
+        if self._mapped is not None:
+            return
         try:
-            query_vec = self.vectorizer.transform([query])
-        except ValueError:
-            vocab_size = len(self.vectorizer.vocabulary_) if hasattr(self.vectorizer, "vocabulary_") else 0
-            query_vec = csr_matrix((1, vocab_size))
+            self._maintain_index()
+        finally:
+            # Even a failed update publishes what changed, or searches keep the stale snapshot.
+            if self._snapshot is None or self._snapshot.version != self.version:
+                self._publish()
 
-        candidate_terms = self._fuzzy_term_match(query)
-        candidate_indices = set()
-        for term in candidate_terms:
-            candidate_indices.update(self.term_index.get(term, set()))
+    def _publish(self):
+        """
+        Build a new snapshot from the current state and swap it in with a
+        single assignment. Only postings of the touched terms are frozen, and
+        terms added since the automaton was built are matched separately, so
+        a publish costs O(MAX_PENDING_TERMS) rather than O(KB).
+        """
+        if self._touched_terms is None:
+            self._postings = {term: frozenset(indices) for term, indices in self.term_index.items()}
+            self._pending_postings = {}
+        else:
+            pending = dict(self._pending_postings)
+            pending.update((term, frozenset(self.term_index[term])) for term in self._touched_terms)
+            if len(pending) > MAX_PENDING_TERMS:
+                self._postings, pending = {**self._postings, **pending}, {}
+            self._pending_postings = pending
+        self._touched_terms = set()
 
-        similarities = []
-        for idx in candidate_indices:
-            entry = self.knowledge[idx]
-            entry_vec = entry["vector"]
+        if self._automaton is None or self._new_terms is None or len(self._new_terms) > MAX_PENDING_TERMS:
+            self._automaton = AhoCorasick(self.term_index)
+            self._token_base = {token: tuple(terms) for token, terms in self._token_terms.items()}
+            self._new_terms, self._new_tokens = [], set()
+        recent_tokens = {token: tuple(self._token_terms[token]) for token in self._new_tokens}
 
-            if isinstance(entry_vec, np.ndarray):
-                entry_vec = csr_matrix(entry_vec.reshape(1, -1))
-            elif not issparse(entry_vec):
-                entry_vec = csr_matrix(entry_vec)
+        # The hashing counters change in place on every add and delete.
+        vectorizer = self.vectorizer.copy() if self.backend == "hashing" else self.vectorizer
+        self._snapshot = IndexSnapshot(
+            self.version, vectorizer, self._matrix, tuple(block for block, _ in self._tail),
+            ChainMap(self._pending_postings, self._postings) if self._pending_postings else self._postings,
+            ChainMap(recent_tokens, self._token_base) if recent_tokens else self._token_base,
+            self._automaton, self.knowledge, len(self.knowledge), tuple(self._new_terms),
+        )
 
-            dot_product = entry_vec.dot(query_vec.T)[0, 0]
-            norm_entry = np.sqrt(entry_vec.power(2).sum())
-            norm_query = np.sqrt(query_vec.power(2).sum())
-            sim = dot_product / (norm_entry * norm_query + 1e-8)
+    def _set_index(self, vectors: csr_matrix, norms: np.ndarray = None):
+        """
+        Keep all entry vectors as one row-normalized CSR matrix (row i is
+        entry i) together with the rows' original norms, so a cosine score is
+        a plain dot product with the normalized query.
+        """
+        self._matrix, self._norms = self._normalize(vectors, norms)
+        self._tail = []
 
-            if sim >= similarity_threshold:
-                similarities.append((sim, idx))
+    @staticmethod
+    def _normalize(vectors: csr_matrix, norms: np.ndarray = None):
+        vectors = csr_matrix(vectors, dtype=np.float64)
+        if norms is None:
+            norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+            scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+            vectors = csr_matrix(vectors.multiply(scale[:, None]))
+        vectors.sort_indices()
+        return vectors, norms
 
-        similarities.sort(key=lambda x: -x[0])
-        top_results = similarities[:min(top_n, len(similarities))]
+    def _cache_key(self, query: str, top_n: int, similarity_threshold: float):
+        # Outer whitespace changes neither tokens nor contained terms.
+        return query.strip(), top_n, similarity_threshold
 
-        term_pool = defaultdict(list)
-        for sim, idx in top_results:
-            entry = self.knowledge[idx]
-            valid_terms = {
-                cn: en for cn, en in entry["terms"].items()
-                if cn in candidate_terms
-            }
-            for cn, en in valid_terms.items():
-                term_pool[cn].append((en, sim))
+    def _cache_get(self, key):
+        with self._cache_lock:
+            if self._cache_version != self.version:
+                self._cache.clear()
+                self._cache_version = self.version
+            result = self._cache.get(key)
+            if result is None:
+                self._cache_stats["misses"] += 1
+                return None
+            self._cache.move_to_end(key)
+            self._cache_stats["hits"] += 1
+        return [dict(match) for match in result]
 
-        final_results = []
-        for cn, candidates in term_pool.items():
-            best_trans = max(candidates, key=lambda x: x[1])[0]
-            final_results.append({
-                "source_term": cn,
-                "target_term": best_trans
-            })
+    def _cache_put(self, key, result: list, version: int):
+        with self._cache_lock:
+            if self.cache_size and version == self.version == self._cache_version:
+                self._cache[key] = [dict(match) for match in result]
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
 
-        return final_results
+    def cache_stats(self) -> dict:
+        with self._cache_lock:
+            lookups = self._cache_stats["hits"] + self._cache_stats["misses"]
+            return {**self._cache_stats, "hit_rate": self._cache_stats["hits"] / lookups if lookups else 0.0,
+                    "size": len(self._cache), "version": self.version}
+
+    def search(self, query: str, top_n: int = 9, similarity_threshold: float = 0):
+        snapshot = self._read_snapshot()
+
+        key = self._cache_key(query, top_n, similarity_threshold)
+        if self.cache_size:
+            cached = self._cache_get(key)
+            if cached is not None:
+                return cached
+
+        result = snapshot.search_one(key[0], top_n, similarity_threshold)
+        self._cache_put(key, result, snapshot.version)
+        return result
+
+    def search_many(self, queries: List[str], top_n: int = 9, similarity_threshold: float = 0,
+                    processes: int = None, chunk_size: int = 256):
+        """
+        Bulk equivalent of `search`. Queries are handled in chunks of
+        `chunk_size`: each chunk is transformed in one call and scored with a
+        single sparse product against the union of its candidate rows, and
+        each query then reads only its own candidates from that block. Ties
+        in similarity are broken by entry order.
+
+        With `processes`, chunks are spread over a process pool that receives
+        the index snapshot once per worker; worthwhile only for very large batches.
+        """
+        snapshot = self._read_snapshot()
+
+        if not snapshot.size:
+            return [[] for _ in queries]
+
+        keys = [self._cache_key(query, top_n, similarity_threshold) for query in queries]
+        results = [self._cache_get(key) if self.cache_size else None for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        pending = [keys[i][0] for i in missing]
+
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        if processes and len(chunks) > 1:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(processes, initializer=_init_search_worker, initargs=(snapshot,)) as pool:
+                jobs = [(chunk, top_n, similarity_threshold) for chunk in chunks]
+                computed = [result for block in pool.map(_search_worker_chunk, jobs) for result in block]
+        else:
+            computed = [result for chunk in chunks
+                        for result in snapshot.search_block(chunk, top_n, similarity_threshold)]
+
+        for i, result in zip(missing, computed):
+            results[i] = result
+            self._cache_put(keys[i], result, snapshot.version)
+        return results
 
+    def __getstate__(self):
+        # Background refit state stays with the process that owns it.
+        state = dict(self.__dict__)
+        state["_refit_thread"] = None
+        state["_refit_result"] = None
+        state["_cache"] = OrderedDict()
+        state["_cache_lock"] = None
+        state["_write_lock"] = None
+        state["_snapshot"] = None
+        state["_touched_terms"] = None
+        state["_new_terms"] = None
+        state["_writers"] = 0
+        if self._mapped is not None:
+            # Re-attached from the file on unpickling.
+            for name in ("knowledge", "term_index", "vectorizer"):
+                state[name] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cache_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        if self._mapped is not None:
+            self._attach(self._mapped)
+        else:
+            self._publish()
+
+    @_mutating
     def batch_import(self, import_path: str):
         with open(import_path, 'r', encoding='utf-8') as f:
             data = json.load(f)
@@ -138,7 +1147,7 @@ class ContextAwareKnowledgeBase:
                 if 'context' not in item or 'terms' not in item:
                     raise ValueError("Missing required fields")
 
-                if any(entry['context'] == item['context'] for entry in self.knowledge):
+                if item['context'] in self._context_index:
                     stats['skipped'] += 1
                     continue
 
@@ -151,46 +1160,94 @@ class ContextAwareKnowledgeBase:
         return stats
 
     def delete_entries(self, context: str):
+        return self.delete_many([context])
+
+    @_mutating
+    def delete_many(self, contexts: List[str]) -> int:
+        """
+        Delete every entry whose context is in `contexts` and return how many
+        were deleted. Entries are only tombstoned: they drop out of
+        term_index at once, while the indices of the remaining entries stay
+        unchanged until enough deletes accumulate for a lazy compaction.
+        """
         deleted = 0
-        for i in range(len(self.knowledge) - 1, -1, -1):
-            if self.knowledge[i]['context'] == context:
+        for context in set(contexts):
+            for i in self._context_index.pop(context, ()):
                 for term in self.knowledge[i]['terms']:
                     self.term_index[term].discard(i)
-                    for t in self.term_index:
-                        self.term_index[t] = {
-                            idx if idx < i else idx - 1
-                            for idx in self.term_index[t]
-                        }
-                del self.knowledge[i]
+                    self._touch(term)
+                if self.backend == "hashing":
+                    self.vectorizer.remove([context])
+                self._tombstones.add(i)
                 deleted += 1
-                self._dirty = True
+        self._changes += deleted
+        if deleted:
+            self.version += 1
         return deleted
 
-    def _fuzzy_term_match(self, text: str):
-        matched_terms = set()
-        tokenized = set(re.findall(r'[\w\u4e00-\u9fff]+', text))
+    def _maybe_compact(self):
+        if len(self._tombstones) > COMPACT_RATIO * len(self.knowledge):
+            self._compact()
 
-        for term in self.term_index:
-            if term in text:
-                matched_terms.add(term)
-                continue
+    def _compact(self):
+        """Drop tombstoned entries, renumbering the remaining ones in order."""
+        if not self._tombstones:
+            return
 
-            term_tokens = set(re.findall(r'[\w\u4e00-\u9fff]+', term))
-            if len(term_tokens & tokenized) / len(term_tokens) >= 0.5:
-                matched_terms.add(term)
+        keep = [i for i in range(len(self.knowledge)) if i not in self._tombstones]
+        new_index = {old: new for new, old in enumerate(keep)}
+        self._merge_tail()
+        self.knowledge = [self.knowledge[i] for i in keep]
+        # Rows not vectorized yet (pending appends) are simply absent from the matrix.
+        rows = [i for i in keep if i < self._matrix.shape[0]]
+        self._set_index(self._matrix[rows], self._norms[rows])
+        self._layout += 1
+        for term, indices in self.term_index.items():
+            self.term_index[term] = {new_index[i] for i in indices}
+        self._touched_terms = None
+        self._tombstones = set()
+        self._reindex_contexts()
 
-        return matched_terms
+    def _reindex_contexts(self):
+        self._context_index = {}
+        for i, entry in enumerate(self.knowledge):
+            if i not in self._tombstones:
+                self._context_index.setdefault(entry["context"], []).append(i)
+
+    def _index_term(self, term: str):
+        term_tokens = set(re.findall(r'[\w\u4e00-\u9fff]+', term))
+        for token in term_tokens:
+            self._token_terms[token].append((term, len(term_tokens)))
+        if self._new_terms is not None:
+            self._new_terms.append(term)
+            self._new_tokens.update(term_tokens)
 
+    def _reindex_terms(self):
+        self._token_terms = defaultdict(list)
+        self._new_terms = None
+        for term in self.term_index:
+            self._index_term(term)
+
+    @_mutating
     def save(self, filepath: str = None):
         save_path = Path(filepath) if filepath else self.filepath
         if not save_path:
             raise ValueError("Storage path must be specified")
 
+        if save_path.name.endswith(".npz"):
+            self.save_snapshot(str(save_path))
+            return
+        if self.backend == "hashing":
+            raise ValueError("A hashing-backend KB can only be saved in the binary (.npz) format")
+
+        self._compact()
         if self._dirty:
             self._rebuild_vectors()
+        self._merge_tail()
 
+        vectorizer = self.vectorizer or _tfidf_vectorizer()
         serializable_params = {}
-        for k, v in self.vectorizer.get_params().items():
+        for k, v in vectorizer.get_params().items():
             if inspect.isclass(v):
                 serializable_params[k] = f"CLASS:{v.__module__}.{v.__name__}"
             elif callable(v):
@@ -203,10 +1260,10 @@ class ContextAwareKnowledgeBase:
                 {
                     "context": entry["context"],
                     "terms": entry["terms"],
-                    "vector_data": entry["vector"].toarray().flatten().tolist(),
-                    "vector_shape": list(entry["vector"].shape)
+                    "vector_data": (self._matrix[i] * self._norms[i]).toarray().flatten().tolist(),
+                    "vector_shape": [1, self._matrix.shape[1]]
                 }
-                for entry in self.knowledge
+                for i, entry in enumerate(self.knowledge)
             ],
             "term_index": {k: list(v) for k, v in self.term_index.items()},
             "vectorizer_params": serializable_params
@@ -228,8 +1285,13 @@ class ContextAwareKnowledgeBase:
             return f"FUNCTION:{obj.__name__}"
         raise TypeError(f"Object not serializable: {obj}")
 
+    @_exclusive
     def load(self, filepath: str):
         path = Path(filepath)
+        if path.name.endswith(".npz"):
+            self.load_snapshot(filepath)
+            return
+
         with open(path, 'r', encoding='utf-8') as f:
             save_data = json.load(f)
 
@@ -237,24 +1299,235 @@ class ContextAwareKnowledgeBase:
         if 'ngram_range' in params and isinstance(params['ngram_range'], list):
             params['ngram_range'] = tuple(params['ngram_range'])
 
-        self.vectorizer = TfidfVectorizer(**params)
+        if self.backend == "hashing":
+            contexts = [entry_data["context"] for entry_data in save_data["knowledge"]]
+            self.vectorizer = HashingTfidfVectorizer(self.hashing_features).partial_fit(contexts)
+        else:
+            self.vectorizer = _tfidf_vectorizer(**params)
 
+        # Stored vectors are not reused: the vectorizer is refitted and the
+        # index rebuilt on first use.
+        self._set_index(csr_matrix((0, 0)))
         self.knowledge = []
         for entry_data in save_data["knowledge"]:
-            if entry_data["vector_data"]:
-                dense_array = np.array(entry_data["vector_data"])
-                vector = csr_matrix(dense_array.reshape(entry_data["vector_shape"]))
-            else:
-                vector = csr_matrix((0, 0))
-
             self.knowledge.append({
                 "context": entry_data["context"],
-                "terms": entry_data["terms"],
-                "vector": vector
+                "terms": entry_data["terms"]
             })
 
         self.term_index = defaultdict(set)
         for term, indices in save_data["term_index"].items():
             self.term_index[term] = set(indices)
+        self._reindex_terms()
+        self._touched_terms = None
+        self._mapped = None
+        self._tombstones = set()
+        self._reindex_contexts()
+        self._layout += 1
+        self._refit_result = None
+        self.version += 1
 
         self._dirty = True
+
+    @_mutating
+    def save_snapshot(self, filepath: str, source: str = ""):
+        """
+        Write the KB in the binary format (version SNAPSHOT_VERSION): one
+        uncompressed .npz of plain arrays, readable without pickle.
+
+        - format_version, source: format number and what the file was built from
+        - backend: "tfidf" or "hashing" (absent in older files: "tfidf")
+        - vocabulary, idf, token_pattern, lowercase: the fitted vectorizer,
+          column order (tfidf)
+        - hash_features, hash_columns, hash_df, hash_documents: the nonzero
+          document-frequency counters of the hashed feature space (hashing)
+        - data, indices, indptr, shape, norms: the row-normalized CSR index
+        - contexts: one string per entry
+        - entry_term_offsets, term_sources, term_targets: each entry's terms
+        - posting_terms, posting_offsets, postings: term_index as int arrays
+
+        Each string list is a _string_table: name_bytes, name_offsets.
+        """
+        self._compact()
+        if self._dirty:
+            self._rebuild_vectors()
+        self._merge_tail()
+
+        if self.backend == "hashing":
+            vocabulary, idf = [], np.zeros(0)
+            columns = np.flatnonzero(self.vectorizer.df)
+            settings = {"hash_features": np.array(self.vectorizer.n_features), "hash_columns": columns,
+                       "hash_df": self.vectorizer.df[columns], "hash_documents": np.array(self.vectorizer.n_documents)}
+        else:
+            vectorizer = FrozenTfidfVectorizer.from_fitted(self.vectorizer)
+            vocabulary = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+            idf = vectorizer.idf_
+            settings = {"token_pattern": np.array(vectorizer.token_pattern), "lowercase": np.array(vectorizer.lowercase)}
+        matrix = self._matrix
+
+        sources = [cn for entry in self.knowledge for cn in entry["terms"]]
+        targets = [en for entry in self.knowledge for en in entry["terms"].values()]
+        entry_term_offsets = np.cumsum([0] + [len(entry["terms"]) for entry in self.knowledge])
+
+        posting_terms = list(self.term_index)
+        postings = [sorted(self.term_index[term]) for term in posting_terms]
+        posting_offsets = np.cumsum([0] + [len(entries) for entries in postings])
+
+        arrays = {
+            "format_version": np.array(SNAPSHOT_VERSION),
+            "source": np.array(source),
+            "backend": np.array(self.backend),
+            "idf": idf,
+            **settings,
+            "data": matrix.data, "indices": matrix.indices, "indptr": matrix.indptr,
+            "shape": np.array(matrix.shape), "norms": self._norms,
+            "entry_term_offsets": entry_term_offsets.astype(np.int64),
+            "posting_offsets": posting_offsets.astype(np.int64),
+            "postings": np.fromiter((i for entries in postings for i in entries), dtype=np.int32,
+                                    count=int(posting_offsets[-1])),
+        }
+        for name, strings in (("vocabulary", vocabulary), ("contexts", [e["context"] for e in self.knowledge]),
+                              ("term_sources", sources), ("term_targets", targets),
+                              ("posting_terms", posting_terms)):
+            arrays.update((name + "_" + k, v) for k, v in _string_table(strings).items())
+
+        partial_path = f"{filepath}.partial.{os.getpid()}"
+        with open(partial_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(partial_path, filepath)
+
+    @_exclusive
+    def load_snapshot(self, filepath: str) -> str:
+        """Load a file written by save_snapshot and return its `source`."""
+        with np.load(filepath, allow_pickle=False) as data:
+            version = int(data["format_version"]) if "format_version" in data else 0
+            if version != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported KB snapshot version {version} in {filepath} "
+                                 f"(expected {SNAPSHOT_VERSION})")
+            arrays = dict(data)
+
+        def strings(name: str) -> List[str]:
+            return _unpack_strings(arrays[name + "_bytes"], arrays[name + "_offsets"])
+
+        self.backend = str(arrays["backend"]) if "backend" in arrays else "tfidf"
+        if self.backend == "hashing":
+            self.hashing_features = int(arrays["hash_features"])
+            df = np.zeros(self.hashing_features, dtype=np.int32)
+            df[arrays["hash_columns"]] = arrays["hash_df"]
+            self.vectorizer = HashingTfidfVectorizer(self.hashing_features, df, int(arrays["hash_documents"]))
+        else:
+            vocabulary = strings("vocabulary")
+            self.vectorizer = FrozenTfidfVectorizer(dict(zip(vocabulary, range(len(vocabulary)))), arrays["idf"],
+                                                    str(arrays["token_pattern"]), bool(arrays["lowercase"]))
+
+        sources, targets = strings("term_sources"), strings("term_targets")
+        offsets = arrays["entry_term_offsets"].tolist()
+        self.knowledge = [
+            {"context": context, "terms": dict(zip(sources[start:end], targets[start:end]))}
+            for context, start, end in zip(strings("contexts"), offsets, offsets[1:])
+        ]
+        matrix = csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]), shape=tuple(arrays["shape"]))
+        self._set_index(matrix, arrays["norms"])
+
+        postings = arrays["postings"].tolist()
+        offsets = arrays["posting_offsets"].tolist()
+        self.term_index = defaultdict(set)
+        for term, start, end in zip(strings("posting_terms"), offsets, offsets[1:]):
+            self.term_index[term] = set(postings[start:end])
+        self._reindex_terms()
+        self._touched_terms = None
+        self._mapped = None
+        self._tombstones = set()
+        self._reindex_contexts()
+        self._fit_size, self._changes = len(self.knowledge), 0
+        self._layout += 1
+        self._refit_result = None
+        self.version += 1
+
+        self._dirty = False
+        return str(arrays["source"])
+
+    @_mutating
+    def save_index(self, filepath: str, source: str = ""):
+        """
+        Write the published snapshot as a KB index (version INDEX_VERSION)
+        for attach_index: every structure a search reads, as flat arrays.
+
+        - data, indices, indptr (header: shape): the row-normalized CSR index
+        - vocabulary_*, idf (header: token_pattern, lowercase) or hash_df
+          (hashing): the vectorizer, which must be freezable (ValueError)
+        - terms_*: the term strings, ids are positions; *_slots are crc32
+          open-addressing tables for string lookups
+        - posting_offsets, postings: term id -> entry indices
+        - tokens_*, token_offsets, token_term_ids, token_term_counts: the
+          token -> term index of the fuzzy matcher
+        - edge_keys, edge_targets, fail, output, next_output: the term automaton
+        - contexts_*, entry_term_offsets, entry_term_ids, targets_*: the entries
+        """
+        snapshot = self._read_snapshot()
+        entries = snapshot.entries[:snapshot.size]
+
+        terms = list(snapshot.term_index)
+        term_ids = {term: i for i, term in enumerate(terms)}
+        for entry in entries:
+            for term in entry["terms"]:
+                if term not in term_ids:
+                    term_ids[term] = len(terms)
+                    terms.append(term)
+        postings = [sorted(snapshot.term_index.get(term, ())) for term in terms]
+        tokens = list(snapshot.token_terms)
+        token_terms = [pair for token in tokens for pair in snapshot.token_terms[token]]
+        matrix = vstack([snapshot.matrix, *snapshot.tail]).tocsr() if snapshot.tail else snapshot.matrix
+
+        arrays = {"data": matrix.data, "indices": matrix.indices, "indptr": matrix.indptr}
+        header = {"source": source, "backend": self.backend, "size": snapshot.size, "shape": list(matrix.shape)}
+        if self.backend == "hashing":
+            arrays["hash_df"] = snapshot.vectorizer.df
+            header.update(n_features=snapshot.vectorizer.n_features, n_documents=snapshot.vectorizer.n_documents)
+        else:
+            vectorizer = FrozenTfidfVectorizer.from_fitted(snapshot.vectorizer)
+            vocabulary = vectorizer.vocabulary_
+            header.update(token_pattern=vectorizer.token_pattern, lowercase=vectorizer.lowercase)
+            arrays["idf"] = vectorizer.idf_
+            arrays["vocabulary_columns"] = np.array(list(vocabulary.values()), dtype=np.int32)
+            arrays.update(("vocabulary_" + k, v) for k, v in _string_table(list(vocabulary), lookup=True).items())
+        arrays.update(("terms_" + k, v) for k, v in _string_table(terms, lookup=True).items())
+        arrays["posting_offsets"] = np.cumsum([0] + [len(p) for p in postings], dtype=np.int64)
+        arrays["postings"] = np.fromiter((i for p in postings for i in p), dtype=np.int32,
+                                         count=int(arrays["posting_offsets"][-1]))
+        arrays.update(("tokens_" + k, v) for k, v in _string_table(tokens, lookup=True).items())
+        arrays["token_offsets"] = np.cumsum([0] + [len(snapshot.token_terms[t]) for t in tokens], dtype=np.int64)
+        arrays["token_term_ids"] = np.array([term_ids[term] for term, _ in token_terms], dtype=np.int32)
+        arrays["token_term_counts"] = np.array([count for _, count in token_terms], dtype=np.int32)
+        automaton = AhoCorasick(snapshot.term_index) if snapshot.recent_terms else snapshot.automaton
+        arrays.update(MappedAutomaton.arrays(automaton, term_ids))
+        arrays.update(("contexts_" + k, v) for k, v in _string_table([e["context"] for e in entries]).items())
+        arrays["entry_term_offsets"] = np.cumsum([0] + [len(e["terms"]) for e in entries], dtype=np.int64)
+        arrays["entry_term_ids"] = np.array([term_ids[cn] for e in entries for cn in e["terms"]], dtype=np.int32)
+        arrays.update(("targets_" + k, v)
+                      for k, v in _string_table([en for e in entries for en in e["terms"].values()]).items())
+
+        MappedIndexSnapshot.write(filepath, arrays, **header)
+
+    @_exclusive
+    def attach_index(self, filepath: str) -> str:
+        """
+        Serve searches from a file written by save_index, mapped read-only
+        and shared with every other process attached to it, and return its
+        `source`. Changing the KB afterwards needs a load().
+        """
+        self._attach(MappedIndexSnapshot(filepath, self.version + 1))
+        return self._mapped.source
+
+    def _attach(self, snapshot: MappedIndexSnapshot):
+        self._mapped = snapshot
+        self.backend = snapshot.header["backend"]
+        self.knowledge, self.term_index, self.vectorizer = snapshot.entries, snapshot.term_index, snapshot.vectorizer
+        self._matrix, self._norms, self._tail = snapshot.matrix, np.zeros(0), []
+        self._token_terms, self._automaton, self._new_terms = defaultdict(list), None, None
+        self._context_index, self._tombstones = {}, set()
+        self._fit_size, self._changes, self._dirty = len(self.knowledge), 0, False
+        self._layout += 1
+        self._refit_result = None
+        self.version = snapshot.version
+        self._snapshot = snapshot
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import getopt
+import random
+import tempfile
+
+from openai import OpenAI
+
+from mock_server import MockServer, DEFAULT_PROFILE
+from generation_pipeline import generate_comments
+
+
+# =========================================================
+# Offline load test of generate_comments against the mock endpoint
+# =========================================================
+
+def build_dataset(path: str, knowledge_path: str, items: int, seed: int = 0):
+    """
+    Synthetic input whose official docs are sampled from the knowledge base,
+    so retrieval does realistic work. Titles are unique, so prompts never dedup.
+    """
+    random.seed(seed)
+    contexts = ["该接口用于获取应用信息。"]
+    if os.path.exists(knowledge_path):
+        with open(knowledge_path, "r", encoding="utf-8") as f:
+            contexts = [entry["context"] for entry in json.load(f)["knowledge"]]
+
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(items):
+            item = {"apiIntro": {"title": f"loadTestApi{i}", "official_doc": random.choice(contexts),
+                                 "tags": ["@since 12", "@syscap SystemCapability.Test"]}}
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def run_level(server: MockServer, input_file: str, knowledge_path: str, workdir: str,
+              workers: int, prompt_layout: str = "legacy", **options) -> dict:
+    client = OpenAI(api_key="mock", base_url=server.url, max_retries=0)
+    output_file = os.path.join(workdir, f"output_{prompt_layout}_{workers}.txt")
+    # Every run starts from a cold prefix cache, as the prompts repeat across runs.
+    server.reset_prefix_cache()
+    summary = generate_comments(input_file, output_file, knowledge_path, client, workers=workers,
+                                metrics_path=output_file + ".metrics.jsonl",
+                                prompt_layout=prompt_layout, **options)
+
+    fields = summary["fields"]
+    latency = fields.get("latency_s", {})
+    shared = fields.get("shared_prefix_chars", {}).get("mean", 0.0)
+    return {
+        "layout": prompt_layout,
+        "workers": workers,
+        "items_per_s": summary["items_per_s"],
+        "shared_prefix": shared / max(fields.get("prompt_chars", {}).get("mean", 0.0), 1.0),
+        "ttft_p50_ms": fields.get("ttft_s", {}).get("p50", 0.0) * 1000,
+        "p50_ms": latency.get("p50", 0.0) * 1000,
+        "p95_ms": latency.get("p95", 0.0) * 1000,
+        "p99_ms": latency.get("p99", 0.0) * 1000,
+    }
+
+
+def main(argv):
+    opts, _ = getopt.getopt(argv, "", ["items=", "levels=", "knowledge_path=", "first_line_only",
+                                       "prompt_layouts="] +
+                            [f"{name}=" for name in DEFAULT_PROFILE])
+    options = dict(opts)
+
+    items = int(options.get("--items", 200))
+    levels = [int(level) for level in options.get("--levels", "1,4,16,64").split(",")]
+    layouts = options.get("--prompt_layouts", "legacy").split(",")
+    knowledge_path = options.get("--knowledge_path", "knowledge_base/HM_knowledge_content.json")
+    profile = {name: type(default)(options[f"--{name}"])
+               for name, default in DEFAULT_PROFILE.items() if f"--{name}" in options}
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir, MockServer(**profile) as server:
+        input_file = os.path.join(workdir, "input.jsonl")
+        build_dataset(input_file, knowledge_path, items)
+        for layout in layouts:
+            for workers in levels:
+                results.append(run_level(server, input_file, knowledge_path, workdir, workers, layout,
+                                         first_line_only="--first_line_only" in options))
+        counters = server.counters()
+
+    print(f"\n{'layout':>8}{'workers':>8}{'items/s':>12}{'shared':>9}{'ttft ms':>10}"
+          f"{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for row in results:
+        print(f"{row['layout']:>8}{row['workers']:>8}{row['items_per_s']:>12.2f}{row['shared_prefix']:>9.1%}"
+              f"{row['ttft_p50_ms']:>10.1f}{row['p50_ms']:>12.1f}{row['p95_ms']:>12.1f}{row['p99_ms']:>12.1f}")
+
+    # Layout comparison at each concurrency level, relative to the first layout.
+    baseline = {row["workers"]: row for row in results if row["layout"] == layouts[0]}
+    for row in results:
+        base = baseline[row["workers"]]
+        if row["layout"] != layouts[0] and base["ttft_p50_ms"]:
+            print(f"{row['layout']} vs {layouts[0]} at {row['workers']} workers: shared prefix "
+                  f"{base['shared_prefix']:.1%} -> {row['shared_prefix']:.1%}, p50 TTFT "
+                  f"{base['ttft_p50_ms']:.1f} -> {row['ttft_p50_ms']:.1f} ms "
+                  f"({1 - row['ttft_p50_ms'] / base['ttft_p50_ms']:.1%} lower)")
+    print(f"Mock endpoint counters: {counters}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+import sys
+import getopt
+
+from run_journal import merge_journals
+from input_reader import iter_json_items
+
+
+# =========================================================
+# Merge the journals of sharded runs (--shard i/N) into one output
+# =========================================================
+
+def main(options: dict):
+    journals = options["--journals"].split(",")
+    output_file = options["--output_file"]
+
+    total = None
+    if "--input_file" in options:
+        total = sum(1 for _ in iter_json_items(options["--input_file"]))
+
+    missing = merge_journals(journals, output_file, total)
+    if missing:
+        shown = ", ".join(str(index) for index in missing[:20])
+        more = f" (+{len(missing) - 20} more)" if len(missing) > 20 else ""
+        print(f"Cannot merge: {len(missing)} items missing from the journals: {shown}{more}")
+        sys.exit(1)
+    print(f"Merged {len(journals)} journals into {output_file}")
+
+
+if __name__ == "__main__":
+    opts, _ = getopt.getopt(sys.argv[1:], "", ["journals=", "output_file=", "input_file="])
+    main(dict(opts))
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+import sys
+import json
+import time
+import getopt
+import random
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# =========================================================
+# Local OpenAI-compatible stand-in for the generation endpoints
+# =========================================================
+
+DEFAULT_PROFILE = {
+    "ttft_ms": 300.0,          # median time to first token
+    "ttft_sigma": 0.5,         # lognormal spread of the time to first token (0 = fixed)
+    "tokens_per_sec": 50.0,    # decode speed after the first token
+    "tail_tokens": 40,         # tokens emitted after the first line (reasoning tail)
+    "error_rate": 0.0,         # probability of answering 500
+    "throttle_rate": 0.0,      # probability of answering 429
+    "retry_after": 1.0,        # Retry-After header sent with 429s
+    "prefix_cache": 0,         # 1 = simulate server-side prefix (KV) caching
+    "prefill_share": 0.8,      # share of the time to first token spent prefilling the prompt
+}
+
+PREFIX_BLOCK_CHARS = 256
+
+
+def mock_completion(messages: list, tail_tokens: int) -> list:
+    """
+    Deterministic pseudo-completion: a one-line comment derived from the
+    prompt hash, followed by a tail that a real model would also emit.
+    """
+    prompt = "".join(message.get("content", "") for message in messages)
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    tokens = ["Returns", " the", " mock", " comment", f" {digest}", ".", "\n"]
+    tokens += [" tail"] * tail_tokens
+    return tokens
+
+
+def cached_prefix_fraction(messages: list, blocks: set, lock) -> float:
+    """
+    Share of the prompt found in the simulated prefix cache. Like paged KV
+    caches, the prompt is hashed in fixed-size blocks chained on their
+    prefix, so a block is only reusable if everything before it matched too.
+    """
+    prompt = "".join(message.get("role", "") + message.get("content", "") for message in messages)
+    digest = hashlib.sha256()
+    cached = 0
+    with lock:
+        for start in range(0, len(prompt), PREFIX_BLOCK_CHARS):
+            block = prompt[start:start + PREFIX_BLOCK_CHARS]
+            digest.update(block.encode("utf-8"))
+            key = digest.hexdigest()
+            if key in blocks and cached == start:
+                cached += len(block)
+            blocks.add(key)
+    return cached / len(prompt) if prompt else 0.0
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    profile = DEFAULT_PROFILE
+    stats = None
+    prefix_blocks = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        profile = self.profile
+        self._count("requests")
+
+        draw = random.random()
+        if draw < profile["throttle_rate"]:
+            self._count("throttled")
+            self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit"}},
+                            {"Retry-After": str(profile["retry_after"])})
+            return
+        if draw < profile["throttle_rate"] + profile["error_rate"]:
+            self._count("errors")
+            self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+
+        tokens = mock_completion(body.get("messages", []), profile["tail_tokens"])
+        if body.get("max_tokens"):
+            tokens = tokens[:body["max_tokens"]]
+
+        ttft = profile["ttft_ms"] / 1000.0
+        if profile["ttft_sigma"]:
+            ttft = random.lognormvariate(0, profile["ttft_sigma"]) * ttft
+        if profile["prefix_cache"]:
+            cached = cached_prefix_fraction(body.get("messages", []), self.prefix_blocks, self.stats["lock"])
+            ttft *= 1.0 - profile["prefill_share"] * cached
+        time.sleep(ttft)
+
+        if body.get("stream"):
+            self._stream(body.get("model", "mock"), tokens)
+        else:
+            time.sleep(len(tokens) / profile["tokens_per_sec"])
+            self._send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "mock"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(tokens)}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+
+    def _stream(self, model: str, tokens: list):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        def chunk(delta: dict, finish_reason=None) -> bytes:
+            payload = {"id": "chatcmpl-mock", "object": "chat.completion.chunk",
+                       "created": int(time.time()), "model": model,
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+        delay = 1.0 / self.profile["tokens_per_sec"]
+        try:
+            self.wfile.write(chunk({"role": "assistant", "content": ""}))
+            for i, token in enumerate(tokens):
+                if i:
+                    time.sleep(delay)
+                self.wfile.write(chunk({"content": token}))
+                self.wfile.flush()
+                self._count("tokens")
+            self.wfile.write(chunk({}, "stop"))
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early (e.g. first-line termination).
+            self._count("cancelled")
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _count(self, name: str):
+        with self.stats["lock"]:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+
+class MockServer:
+    """
+    In-process mock endpoint. `url` is the base_url to pass to OpenAI().
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **profile):
+        unknown = set(profile) - set(DEFAULT_PROFILE)
+        if unknown:
+            raise ValueError(f"Unknown profile settings: {sorted(unknown)}")
+
+        self.stats = {"lock": threading.Lock()}
+        self.prefix_blocks = set()
+        handler = type("BoundMockHandler", (MockHandler,),
+                       {"profile": {**DEFAULT_PROFILE, **profile}, "stats": self.stats,
+                        "prefix_blocks": self.prefix_blocks})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://{host}:{self.httpd.server_address[1]}/v1"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_prefix_cache(self):
+        with self.stats["lock"]:
+            self.prefix_blocks.clear()
+
+    def counters(self) -> dict:
+        with self.stats["lock"]:
+            return {k: v for k, v in self.stats.items() if k != "lock"}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv):
+    opts, _ = getopt.getopt(argv, "", ["host=", "port="] + [f"{name}=" for name in DEFAULT_PROFILE])
+    options = dict(opts)
+
+    profile = {name: type(default)(options[f"--{name}"])
+               for name, default in DEFAULT_PROFILE.items() if f"--{name}" in options}
+    server = MockServer(options.get("--host", "127.0.0.1"), int(options.get("--port", 8000)), **profile)
+    print(f"Mock endpoint listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,150 @@
+import time
+import random
+import threading
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `per_minute` units per minute.
+    `acquire` blocks until the requested amount is available; requests larger
+    than the bucket capacity are clipped to it so they can still proceed.
+    """
+
+    def __init__(self, per_minute: float, capacity: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                delay = (amount - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def is_throttled(exc: Exception) -> bool:
+    return getattr(exc, "status_code", None) == 429
+
+
+def is_retryable(exc: Exception) -> bool:
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status in (408, 409, 429) or status >= 500
+    # openai raises APIConnectionError / APITimeoutError without a status code.
+    return isinstance(exc, (ConnectionError, TimeoutError)) or \
+        type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def retry_after(exc: Exception):
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EndpointLimiter:
+    """
+    Client-side admission control for one LLM endpoint.
+
+    - requests/min and tokens/min token buckets;
+    - retries of 429, 408/409, 5xx and connection errors with jittered
+      exponential backoff (honouring Retry-After when present);
+    - a circuit breaker that holds all callers for `cooldown` seconds after
+      `failure_threshold` consecutive failures before letting traffic resume;
+    - AIMD concurrency: the in-flight limit grows by one per window of
+      successes and is halved on every throttled response, settling near the
+      highest rate the endpoint sustains.
+    """
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 max_concurrency: int = 8, min_concurrency: int = 1, max_retries: int = 6,
+                 base_delay: float = 1.0, max_delay: float = 60.0,
+                 failure_threshold: int = 5, cooldown: float = 30.0):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self.limit = float(max_concurrency)
+        self.inflight = 0
+        self.failures = 0
+        self.open_until = 0.0
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "errors": 0, "circuit_opened": 0}
+        self._cond = threading.Condition()
+
+    def call(self, fn, tokens: float = 0):
+        """
+        Run `fn()` under the limiter and return (result, retries).
+        Non-retryable errors, and retryable ones past `max_retries`, are re-raised.
+        """
+        for attempt in range(self.max_retries + 1):
+            self._admit()
+            if self.requests:
+                self.requests.acquire(1)
+            if self.tokens and tokens:
+                self.tokens.acquire(tokens)
+
+            try:
+                result = fn()
+            except Exception as exc:
+                retry = is_retryable(exc) and attempt < self.max_retries
+                self._release(success=False, throttled=is_throttled(exc), retry=retry)
+                if not retry:
+                    raise
+                delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+                time.sleep(retry_after(exc) or random.uniform(0, delay))
+                continue
+
+            self._release(success=True)
+            return result, attempt
+
+    def _admit(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self.open_until:
+                    self._cond.wait(self.open_until - now)
+                elif self.inflight >= int(self.limit):
+                    self._cond.wait()
+                else:
+                    self.inflight += 1
+                    self.stats["requests"] += 1
+                    return
+
+    def _release(self, success: bool, throttled: bool = False, retry: bool = False):
+        with self._cond:
+            self.inflight -= 1
+            if success:
+                self.failures = 0
+                self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+            else:
+                self.failures += 1
+                self.stats["retries" if retry else "errors"] += 1
+                if throttled:
+                    self.stats["throttled"] += 1
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                if self.failures >= self.failure_threshold:
+                    self.open_until = time.monotonic() + self.cooldown
+                    self.failures = 0
+                    self.stats["circuit_opened"] += 1
+            self._cond.notify_all()
+
+    def summary(self) -> dict:
+        with self._cond:
+            return {**self.stats, "concurrency_limit": round(self.limit, 2)}
@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+import threading
+
+
+class RunJournal:
+    """
+    Append-only completion journal for generation runs.
+
+    Every finished item is appended as one JSON line holding its dataset index,
+    a hash of the prompt inputs and the generated comment. Each record is a
+    single write followed by fsync, so after a crash the journal holds every
+    completed item plus at most one torn trailing line, which is dropped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    @staticmethod
+    def item_key(*inputs: str) -> str:
+        payload = json.dumps(inputs, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def load(self) -> dict:
+        """
+        Return {index: record} for every intact record.
+        Duplicate indices keep the latest record.
+        """
+        records = {}
+        if not os.path.exists(self.path):
+            return records
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[record["index"]] = record
+        return records
+
+    def open(self, resume: bool = False):
+        if resume and os.path.exists(self.path):
+            self._drop_torn_tail()
+            self._file = open(self.path, "a", encoding="utf-8")
+        else:
+            self._file = open(self.path, "w", encoding="utf-8")
+        return self
+
+    def _drop_torn_tail(self):
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def record(self, index: int, key: str, comment: str):
+        line = json.dumps({"index": index, "key": key, "comment": comment}, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def merge_journals(paths: list, output_file: str, total: int = None) -> list:
+    """
+    Rebuild one ordered output file from the journals of sharded runs.
+
+    Records are combined by dataset index (a later journal wins on overlap).
+    `total` is the number of input items; without it the highest index seen
+    is assumed to be the last. Returns the missing indices; the output is
+    only written when none are missing.
+    """
+    records = {}
+    for path in paths:
+        records.update(RunJournal(path).load())
+
+    if total is None:
+        total = max(records, default=-1) + 1
+    missing = [index for index in range(total) if index not in records]
+    if missing:
+        return missing
+
+    partial_file = output_file + ".partial"
+    with open(partial_file, "w") as writer:
+        for index in range(total):
+            writer.write(records[index]["comment"] + "\n")
+    os.replace(partial_file, output_file)
+    return missing
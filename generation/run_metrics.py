@@ -0,0 +1,81 @@
+import json
+import time
+import threading
+from collections import defaultdict
+
+# Per-item fields summarized at the end of a run; nested stage records
+# (e.g. "refine") are summarized under "<stage>.<field>".
+SUMMARY_FIELDS = ("retrieval_s", "prompt_s", "prompt_chars", "prompt_tokens", "shared_prefix_chars",
+                  "queue_s", "ttft_s", "latency_s", "output_tokens", "retries")
+
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    rank = max(int(round(q / 100.0 * len(values))) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class MetricsLog:
+    """
+    Thread-safe JSONL sidecar with one record of per-item measurements,
+    plus an end-of-run summary (p50/p95/p99 per field and items per second).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.items = 0
+        self.started = time.monotonic()
+        self._values = defaultdict(list)
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.items += 1
+            self._collect(record, "")
+
+    def _collect(self, record: dict, prefix: str):
+        for field, value in record.items():
+            if isinstance(value, dict):
+                self._collect(value, prefix + field + ".")
+            elif field in SUMMARY_FIELDS and isinstance(value, (int, float)) and not isinstance(value, bool):
+                self._values[prefix + field].append(value)
+
+    def summary(self) -> dict:
+        with self._lock:
+            elapsed = time.monotonic() - self.started
+            fields = {}
+            for field, values in self._values.items():
+                ordered = sorted(values)
+                fields[field] = {
+                    "p50": percentile(ordered, 50),
+                    "p95": percentile(ordered, 95),
+                    "p99": percentile(ordered, 99),
+                    "mean": sum(ordered) / len(ordered),
+                }
+            return {"items": self.items, "elapsed_s": elapsed,
+                    "items_per_s": self.items / elapsed if elapsed else 0.0, "fields": fields}
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        lines = [f"{summary['items']} items in {summary['elapsed_s']:.1f}s "
+                 f"({summary['items_per_s']:.2f} items/s)",
+                 f"{'field':<24}{'p50':>12}{'p95':>12}{'p99':>12}{'mean':>12}"]
+        for field, stats in sorted(summary["fields"].items()):
+            lines.append(f"{field:<24}" + "".join(
+                f"{stats[key]:>12.4g}" for key in ("p50", "p95", "p99", "mean")))
+        return "\n".join(lines)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
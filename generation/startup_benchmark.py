@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import os
+import sys
+import json
+import getopt
+import tempfile
+import subprocess
+from statistics import median
+
+
+# =========================================================
+# Cold-start benchmark of the generation entry point and the KB
+# =========================================================
+
+# Each probe runs in a fresh interpreter and prints its timings (seconds) as JSON.
+PROBES = {
+    "import_pipeline": """
+import time
+start = time.perf_counter()
+import generation_pipeline
+print(json.dumps({"total": time.perf_counter() - start}))
+""",
+    "kb_from_json": """
+import time
+start = time.perf_counter()
+from knowledge_base.contextAware_KB import ContextAwareKnowledgeBase
+imported = time.perf_counter()
+kb = ContextAwareKnowledgeBase(KNOWLEDGE_PATH)
+loaded = time.perf_counter()
+kb.search(QUERY)
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "load": loaded - imported,
+                  "first_search": done - loaded, "total": done - start}))
+""",
+    "kb_from_snapshot": """
+import time
+start = time.perf_counter()
+from knowledge_base.contextAware_KB import ContextAwareKnowledgeBase
+imported = time.perf_counter()
+kb = ContextAwareKnowledgeBase(SNAPSHOT_PATH)
+loaded = time.perf_counter()
+kb.search(QUERY)
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "load": loaded - imported,
+                  "first_search": done - loaded, "total": done - start}))
+""",
+}
+
+QUERY = "该接口用于获取应用信息。"
+
+
+def run_probe(name: str, knowledge_path: str, snapshot_path: str) -> dict:
+    code = (f"import json\nKNOWLEDGE_PATH = {knowledge_path!r}\nSNAPSHOT_PATH = {snapshot_path!r}\n"
+            f"QUERY = {QUERY!r}\n" + PROBES[name])
+    output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(options: dict):
+    knowledge_path = os.path.abspath(options.get("--knowledge_path", "knowledge_base/HM_knowledge_content.json"))
+    repeat = int(options.get("--repeat", 5))
+    budgets = {"import_pipeline": options.get("--max_import_ms"),
+               "kb_from_snapshot": options.get("--max_snapshot_ms")}
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from knowledge_base.contextAware_KB import ContextAwareKnowledgeBase
+
+    over_budget = []
+    with tempfile.TemporaryDirectory() as workdir:
+        snapshot_path = os.path.join(workdir, "knowledge.snapshot.npz")
+        ContextAwareKnowledgeBase(knowledge_path).save_snapshot(snapshot_path)
+
+        print(f"{'probe':<20}{'import ms':>12}{'load ms':>12}{'search ms':>12}{'total ms':>12}")
+        for name in PROBES:
+            runs = [run_probe(name, knowledge_path, snapshot_path) for _ in range(repeat)]
+            # Median of each phase over fresh processes.
+            timings = {phase: median(run[phase] for run in runs) * 1000 for phase in runs[0]}
+            print(f"{name:<20}" + "".join(
+                f"{timings[phase]:>12.1f}" if phase in timings else f"{'-':>12}"
+                for phase in ("import", "load", "first_search", "total")))
+
+            budget = budgets.get(name)
+            if budget is not None and timings["total"] > float(budget):
+                over_budget.append(f"{name}: {timings['total']:.1f} ms > {float(budget):.1f} ms")
+
+    if over_budget:
+        print("Startup budget exceeded: " + "; ".join(over_budget))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    opts, _ = getopt.getopt(sys.argv[1:], "", ["knowledge_path=", "repeat=", "max_import_ms=",
+                                               "max_snapshot_ms="])
+    main(dict(opts))